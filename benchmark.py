@@ -0,0 +1,441 @@
+import sys
+import os
+import json
+import time
+import shutil
+import struct
+import platform
+import argparse
+import statistics
+import subprocess
+import traceback
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [1000, 10000, 100000]
+THUMBNAIL_SAMPLE = 200
+TRACK_SWITCH_SAMPLE = 50
+# Common-prefix queries that match most of a synthetic library, typed one key at a time and pasted whole
+SEARCH_QUERIES = ['artist 5', 'song 1']
+ANIMATION_TICKS = 5000
+DEFAULT_PET_COUNTS = [1, 4, 12]
+PET_RUN_SECONDS = 5
+
+# Every scenario runs in a fresh child process under QT_QPA_PLATFORM=offscreen, inside an app directory
+# of its own (copied images, generated music folder), so caches and peak RSS never leak between scenarios.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmark.py --sizes 1000,10000 --output results.json
+
+### --- SYNTHETIC LIBRARIES --- ###
+def id3_text_frame(frame_id, text):
+    body = b'\x03' + text.encode('utf-8')
+    return frame_id.encode('ascii') + struct.pack('>I', len(body)) + b'\x00\x00' + body
+
+def synthetic_mp3(title, artist, album):
+    frames = id3_text_frame('TIT2', title) + id3_text_frame('TPE1', artist) + id3_text_frame('TALB', album)
+    size = len(frames)
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    # One silent 128 kbit/s, 44.1 kHz MPEG-1 Layer III frame is enough for the header parser
+    audio = b'\xff\xfb\x90\x00' + bytes(413)
+    return b'ID3\x03\x00\x00' + syncsafe + frames + audio
+
+def write_thumbnail(path):
+    from PySide6.QtGui import QImage, QColor, QPainter, QLinearGradient
+    image = QImage(600, 600, QImage.Format.Format_RGB32)
+    painter = QPainter(image)
+    gradient = QLinearGradient(0, 0, 600, 600)
+    gradient.setColorAt(0, QColor("#61afef"))
+    gradient.setColorAt(1, QColor("#98c379"))
+    painter.fillRect(image.rect(), gradient)
+    painter.end()
+    image.save(path, "JPEG", 85)
+
+def generate_library(root, size):
+    marker = os.path.join(root, '.complete')
+    if os.path.exists(marker):
+        return root
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    thumbnail = os.path.join(root, '.thumbnail.jpg')
+    write_thumbnail(thumbnail)
+    # Tracks are backdated so the scanner does not hold the newest ones back as still being copied
+    settled = time.time() - 3600
+    for i in range(size):
+        folder = os.path.join(root, f"Song-{i:06d}")
+        os.mkdir(folder)
+        track = os.path.join(folder, f"Song-{i:06d}_Artist-{i % 997}.mp3")
+        with open(track, 'wb') as f:
+            f.write(synthetic_mp3(f"Song {i}", f"Artist {i % 997}", f"Album {i // 12}"))
+        os.utime(track, (settled, settled))
+        # Thumbnails are hard links to one image so a 100k library stays small on disk
+        try:
+            os.link(thumbnail, os.path.join(folder, 'thumbnail.jpg'))
+        except OSError:
+            shutil.copyfile(thumbnail, os.path.join(folder, 'thumbnail.jpg'))
+    open(marker, 'w').close()
+    return root
+
+def prepare_app_dir(path, library):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    shutil.copytree(os.path.join(REPO_DIR, 'images'), os.path.join(path, 'images'),
+                    ignore=shutil.ignore_patterns('fox-atlas.*'))
+    os.symlink(library, os.path.join(path, 'music'), target_is_directory=True)
+    return path
+
+def write_session(app_dir):
+    # A session that was playing the first track, so startup also measures the time to resumed audio
+    folder = sorted(name for name in os.listdir(os.path.join(app_dir, 'music')) if not name.startswith('.'))[0]
+    track = next(name for name in os.listdir(os.path.join(app_dir, 'music', folder)) if name.endswith('.mp3'))
+    session = {'last_track_path': os.path.join('music', folder, track), 'last_position': 0, 'was_playing': True,
+               'volume': 50, 'is_muted': False, 'playback_mode': 'loop_all'}
+    with open(os.path.join(app_dir, 'config.json'), 'w') as f:
+        json.dump(session, f)
+
+### --- SCENARIOS --- ###
+def summarize(samples_ms):
+    samples = sorted(samples_ms)
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.fmean(samples), 4),
+        'p50_ms': round(samples[len(samples) // 2], 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        'max_ms': round(samples[-1], 4),
+    }
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def wait_for(app, condition, timeout_s=120):
+    deadline = time.perf_counter() + timeout_s
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("condition not reached in time")
+        app.processEvents()
+        time.sleep(0.001)
+
+def skip_onboarding(host):
+    # The onboarding dialog is modal and would block the benchmark until someone answers it
+    for call in host.scheduler.queue:
+        if call.callback == host.pets[0].ask_question:
+            call.cancel()
+
+def run_startup(args):
+    start_ns = time.perf_counter_ns()
+    import main
+    import_ms = (time.perf_counter_ns() - start_ns) / 1e6
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv[:1])
+    host = main.PetHost()
+    skip_onboarding(host)
+    wait_for(app, lambda: 'fox_visible' in main.tracer.marks, timeout_s=30)
+    try:
+        wait_for(app, lambda: 'audio_resumed' in main.tracer.marks, timeout_s=10)
+    except TimeoutError:
+        pass
+    # Tracer marks are relative to the moment main.py started importing
+    offset_ms = (main.tracer.origin - start_ns) / 1e6
+    marks = {name: round(offset_ms + ms, 3) for name, ms in main.tracer.marks.items()}
+    return {
+        'import_ms': round(import_ms, 3),
+        'time_to_tray_ready_ms': marks['tray_ready'],
+        'time_to_first_frame_ms': marks['fox_visible'],
+        'time_to_resumed_audio_ms': marks.get('audio_resumed'),
+    }
+
+def run_scan(args):
+    import main
+    from PySide6.QtCore import QCoreApplication
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    results = {}
+    for label in ('cold', 'warm'):
+        scanner = main.LibraryScanner(music_dir='music', db_path='library.db')
+        songs = []
+        scanner.signals.songs_found.connect(songs.extend)
+        started = time.perf_counter()
+        scanner.run()
+        elapsed = time.perf_counter() - started
+        results[label] = {
+            'seconds': round(elapsed, 4),
+            'songs': len(songs),
+            'folders': len(scanner.scanned_folders),
+            'songs_per_second': round(len(songs) / elapsed, 1) if elapsed else None,
+        }
+    return results
+
+def run_animation(args):
+    import main
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv[:1])
+    host = main.PetHost(count=1)
+    pet = host.pets[0]
+    pet.transition('walking')
+    pet.scheduler.suspend()
+    samples = []
+    for _ in range(ANIMATION_TICKS):
+        started = time.perf_counter_ns()
+        pet.update_animation_frame()
+        samples.append((time.perf_counter_ns() - started) / 1e6)
+    return {'update_animation_frame': summarize(samples)}
+
+def run_bubbles(args):
+    # The greeting already created the bubble window; each message is drawn once and later shows only reuse it
+    import main
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv[:1])
+    host = main.PetHost(count=1)
+    pet = host.pets[0]
+    pet.scheduler.suspend()
+    messages = [text for texts in pet.responses.values() for text in texts] + pet.questions
+    samples = {'first_render': [], 'cached': []}
+    for label in samples:
+        for text in messages:
+            started = time.perf_counter_ns()
+            pet.show_bubble(text)
+            samples[label].append((time.perf_counter_ns() - started) / 1e6)
+            app.processEvents()
+    return {label: summarize(values) for label, values in samples.items()}
+
+def run_pets(args):
+    # N foxes walking on the shared scheduler: startup cost, CPU, timer wakeups and the cost of one tick of every fox
+    import main
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv[:1])
+    started = time.perf_counter()
+    host = main.PetHost(count=args.pets)
+    startup_ms = (time.perf_counter() - started) * 1000
+    wait_for(app, lambda: host.music_player.scanner is None)
+    # Every fox starts walking right away instead of waiting for the onboarding question
+    skip_onboarding(host)
+    for pet in host.pets:
+        pet.transition('walking')
+
+    wakeups = len(host.scheduler.wakeup_times)
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    QTimer.singleShot(PET_RUN_SECONDS * 1000, app.quit)
+    app.exec()
+    cpu_s, wall_s = time.process_time() - cpu_started, time.perf_counter() - wall_started
+    wakeups = len(host.scheduler.wakeup_times) - wakeups
+
+    host.scheduler.suspend()
+    samples = []
+    for _ in range(ANIMATION_TICKS // 10):
+        started = time.perf_counter_ns()
+        for pet in host.pets:
+            pet.update_animation_frame()
+        samples.append((time.perf_counter_ns() - started) / 1e6)
+    return {
+        'pets': len(host.pets),
+        'startup_ms': round(startup_ms, 3),
+        'cpu_percent': round(cpu_s / wall_s * 100, 2),
+        'wakeups_per_second': round(wakeups / wall_s, 2),
+        'tick_all_pets': summarize(samples),
+    }
+
+def run_thumbnails(args):
+    import main
+    from PySide6.QtCore import QSize
+    from PySide6.QtGui import QGuiApplication
+    app = QGuiApplication(sys.argv[:1])
+    with os.scandir('music') as entries:
+        folders = sorted(entry.path for entry in entries if entry.is_dir())[:THUMBNAIL_SAMPLE]
+    paths = [os.path.join(folder, 'thumbnail.jpg') for folder in folders]
+    disk_cache = main.ThumbnailDiskCache()
+    signals = main.ThumbnailSignals()
+    loaded = []
+    signals.loaded.connect(lambda path, image: loaded.append(not image.isNull()))
+    results = {}
+    for label in ('cold', 'disk_cache'):
+        samples = []
+        for path in paths:
+            started = time.perf_counter_ns()
+            main.ThumbnailJob(path, QSize(100, 100), disk_cache, signals).run()
+            samples.append((time.perf_counter_ns() - started) / 1e6)
+        results[label] = summarize(samples)
+    results['decoded'] = sum(loaded)
+    return results
+
+def run_search(args):
+    import main
+    from PySide6.QtCore import QCoreApplication
+    app = QCoreApplication(sys.argv[:1])
+    scanner = main.LibraryScanner(music_dir='music', db_path='library.db')
+    model = main.PlaylistModel(main.SongTable())
+    scanner.signals.songs_found.connect(model.append_songs)
+    scanner.run()
+    proxy = main.PlaylistFilterModel(model)
+    slices = []
+    while proxy.index_timer.isActive():
+        started = time.perf_counter_ns()
+        proxy.index_next_chunk()
+        slices.append((time.perf_counter_ns() - started) / 1e6)
+    keystrokes, pasted = [], []
+    for query in SEARCH_QUERIES:
+        for length in range(1, len(query) + 1):
+            started = time.perf_counter_ns()
+            proxy.set_query(query[:length])
+            keystrokes.append((time.perf_counter_ns() - started) / 1e6)
+        proxy.set_query('')
+        started = time.perf_counter_ns()
+        proxy.set_query(query)
+        pasted.append((time.perf_counter_ns() - started) / 1e6)
+        proxy.set_query('')
+    return {
+        'songs': len(model.table),
+        'index_build_ms': round(sum(slices), 3),
+        'index_slice': summarize(slices),
+        'keystroke': summarize(keystrokes),
+        'pasted_query': summarize(pasted),
+    }
+
+def run_track_switch(args):
+    import main
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtGui import QAction
+    app = QApplication(sys.argv[:1])
+    actions = {name: QAction(name) for name in ('play_pause', 'prev', 'next', 'loop', 'mute', 'rescan', 'open')}
+    session = main.SessionStore()
+    engine = main.PlaybackEngine()
+    controller = main.MusicPlayerController(engine, actions, session)
+    wait_for(app, lambda: controller.scanner is None)
+    count = min(TRACK_SWITCH_SAMPLE, len(controller.playlist))
+    play_samples, next_samples = [], []
+    for index in range(count):
+        started = time.perf_counter_ns()
+        controller.play_song(index)
+        play_samples.append((time.perf_counter_ns() - started) / 1e6)
+        app.processEvents()
+    for _ in range(count):
+        started = time.perf_counter_ns()
+        controller.next_song()
+        next_samples.append((time.perf_counter_ns() - started) / 1e6)
+        app.processEvents()
+    session.flush()
+    return {'play_song': summarize(play_samples), 'next_song': summarize(next_samples)}
+
+SCENARIOS = {
+    'startup': run_startup,
+    'scan': run_scan,
+    'animation': run_animation,
+    'pets': run_pets,
+    'bubbles': run_bubbles,
+    'thumbnails': run_thumbnails,
+    'search': run_search,
+    'track_switch': run_track_switch,
+}
+
+def run_child(args):
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(args.app_dir)
+    try:
+        result = SCENARIOS[args.scenario](args)
+    except Exception as e:
+        result = {'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc()}
+    result['peak_rss_mb'] = peak_rss_mb()
+    sys.stdout.write("\n" + json.dumps(result) + "\n")
+    sys.stdout.flush()
+    os._exit(0)
+
+### --- RUNNER --- ###
+def spawn(scenario, app_dir, timeout_s, *extra):
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    env['YOURPET_TRACE'] = os.path.join(app_dir, 'startup-trace.json')
+    command = [sys.executable, os.path.abspath(__file__), '--scenario', scenario, '--app-dir', app_dir, *extra]
+    try:
+        completed = subprocess.run(command, env=env, capture_output=True, text=True, timeout=timeout_s)
+    except subprocess.TimeoutExpired:
+        return {'error': f"timed out after {timeout_s}s"}
+    lines = [line for line in completed.stdout.splitlines() if line.startswith('{')]
+    if not lines:
+        return {'error': f"exit code {completed.returncode}", 'stderr': completed.stderr[-2000:]}
+    return json.loads(lines[-1])
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_suite(args):
+    import PySide6
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'pyside6': PySide6.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'startup': {},
+        'animation': None,
+        'bubbles': None,
+        'pets': {},
+        'libraries': {},
+    }
+
+    smallest = min(args.sizes)
+    for size in args.sizes:
+        print(f"Generating {size}-song library...", file=sys.stderr)
+        library = generate_library(os.path.join(workdir, f"library-{size}"), size)
+        results = {}
+        for scenario in ('scan', 'thumbnails', 'search', 'track_switch'):
+            print(f"  {scenario} ({size})", file=sys.stderr)
+            app_dir = prepare_app_dir(os.path.join(workdir, 'app'), library)
+            results[scenario] = spawn(scenario, app_dir, args.timeout)
+        report['libraries'][str(size)] = results
+
+        if size == smallest:
+            # Cold starts build the sprite atlas and library index; warm starts reuse both
+            app_dir = prepare_app_dir(os.path.join(workdir, 'app'), library)
+            write_session(app_dir)
+            for label in ('cold', 'warm'):
+                print(f"  startup {label}", file=sys.stderr)
+                report['startup'][label] = spawn('startup', app_dir, args.timeout)
+            print("  animation", file=sys.stderr)
+            report['animation'] = spawn('animation', app_dir, args.timeout)
+            print("  bubbles", file=sys.stderr)
+            report['bubbles'] = spawn('bubbles', app_dir, args.timeout)
+            for count in args.pet_counts:
+                print(f"  pets ({count})", file=sys.stderr)
+                report['pets'][str(count)] = spawn('pets', app_dir, args.timeout, '--pets', str(count))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for Your Pet")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        type=lambda value: [int(size) for size in value.split(',')],
+                        help="comma separated library sizes in song folders (default: %(default)s)")
+    parser.add_argument('--pet-counts', default=','.join(map(str, DEFAULT_PET_COUNTS)),
+                        type=lambda value: [int(count) for count in value.split(',')],
+                        help="comma separated numbers of foxes for the multi-pet scenario (default: %(default)s)")
+    parser.add_argument('--workdir', default=os.path.join(REPO_DIR, 'benchmark-data'),
+                        help="where synthetic libraries are generated and kept between runs")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--timeout', type=int, default=1800, help="per scenario timeout in seconds")
+    parser.add_argument('--scenario', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--app-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--pets', type=int, default=1, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    if arguments.scenario:
+        run_child(arguments)
+    else:
+        run_suite(arguments)
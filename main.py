@@ -1,31 +1,1832 @@
 import sys
 import os
 import json
+import sqlite3
+import hashlib
+import heapq
+import unicodedata
+import time
+import threading
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left
+from itertools import count
 from pathlib import Path
-from random import choice, random, randint
+from random import choice, random, randint, shuffle
+from functools import partial
+from collections import namedtuple, OrderedDict, deque
 from datetime import datetime
+
+### --- STARTUP TRACER --- ###
+class StartupTracer:
+    # Launch phases as a Chrome trace (chrome://tracing, ui.perfetto.dev). Enabled with YOURPET_TRACE=<file>
+    # or --trace-startup[=<file>]; while disabled every call returns straight away
+    DEFAULT_PATH = "startup-trace.json"
+
+    def __init__(self, path=None):
+        self.path = path
+        self.origin = time.perf_counter_ns()
+        self.events = []
+        self.open_phases = {}
+        self.thread_names = {}
+        self.marks = {}
+
+    @classmethod
+    def from_arguments(cls, argv):
+        path = os.environ.get("YOURPET_TRACE") or None
+        for arg in argv[1:]:
+            if arg == "--trace-startup" or arg.startswith("--trace-startup="):
+                path = arg.partition("=")[2] or path or cls.DEFAULT_PATH
+        if path == "1":
+            path = cls.DEFAULT_PATH
+        return cls(path)
+
+    def begin(self, name):
+        if self.path:
+            self.open_phases.setdefault(threading.get_ident(), []).append((name, self._now()))
+
+    def end(self):
+        if self.path:
+            name, start = self.open_phases[threading.get_ident()].pop()
+            self._record(name, "X", start, dur=self._now() - start)
+
+    @contextmanager
+    def phase(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def mark(self, name):
+        # Milestones like fox_visible count once, at their first occurrence
+        if not self.path or name in self.marks:
+            return False
+        now = self._now()
+        self.marks[name] = now / 1000
+        self._record(name, "i", now, s="g")
+        return True
+
+    def counter(self, name, value):
+        if self.path:
+            self._record(name, "C", self._now(), args={name: value})
+
+    def write(self):
+        if not self.path:
+            return
+        pid = os.getpid()
+        threads = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                   for tid, name in self.thread_names.items()]
+        trace = {"traceEvents": threads + self.events, "displayTimeUnit": "ms",
+                 "otherData": {"marks_ms": {name: round(ms, 3) for name, ms in self.marks.items()}}}
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(trace, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error writing startup trace: {e}")
+
+    def _now(self):
+        return (time.perf_counter_ns() - self.origin) / 1000
+
+    def _record(self, name, phase, timestamp, **fields):
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = "main" if threading.current_thread() is threading.main_thread() else f"worker-{len(self.thread_names)}"
+        self.events.append({"name": name, "cat": "startup", "ph": phase, "ts": timestamp, "pid": os.getpid(), "tid": tid, **fields})
+
+tracer = StartupTracer.from_arguments(sys.argv)
+
+tracer.begin("import PySide6")
 from PySide6.QtWidgets import (QApplication, QWidget, QLabel, QVBoxLayout, QDialog,
                                QPushButton, QHBoxLayout, QRadioButton, QButtonGroup, QMenu,
-                               QSystemTrayIcon, QListWidget, QSlider, QStyle, QListWidgetItem,
-                               QGraphicsDropShadowEffect, QFrame)
-from PySide6.QtGui import QPixmap, QMovie, QAction, QIcon, QCursor, QColor
-from PySide6.QtCore import Qt, QTimer, QUrl, QSize, QPoint
+                               QSystemTrayIcon, QListView, QSlider, QStyle,
+                               QGraphicsDropShadowEffect, QFrame, QLineEdit)
+from PySide6.QtGui import QPixmap, QAction, QIcon, QCursor, QColor, QImage, QImageReader, QPainter, QFontMetrics
+from PySide6.QtCore import (Qt, QTimer, QUrl, QSize, QPoint, QRect, QRectF, QElapsedTimer, QEvent, QObject, QRunnable, QThreadPool,
+                            Signal, QAbstractListModel, QAbstractProxyModel, QModelIndex, QFileSystemWatcher)
 from PySide6.QtMultimedia import QMediaPlayer, QAudioOutput
+tracer.end()
+
+### --- SONG TABLE --- ###
+Song = namedtuple("Song", ["title", "artist", "path", "thumbnail", "album", "duration"], defaults=("", 0))
+
+def track_id(path):
+    # Stable across launches and rescans, unlike a row in the playlist
+    return int.from_bytes(hashlib.blake2b(path.encode(), digest_size=8).digest(), 'big')
+
+class SongTable:
+    # Parallel columns instead of one dict per track keep 100k-track libraries small
+    __slots__ = ("titles", "artists", "paths", "thumbnails", "albums", "durations", "ids", "id_rows", "stale_from")
+
+    def __init__(self):
+        self.titles = []
+        self.artists = []
+        self.paths = []
+        self.thumbnails = []
+        self.albums = []
+        self.durations = []
+        self.ids = []
+        self.id_rows = {}
+        self.stale_from = sys.maxsize
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, track):
+        return track in self.id_rows
+
+    def __getitem__(self, row):
+        return Song(self.titles[row], self.artists[row], self.paths[row], self.thumbnails[row],
+                    self.albums[row], self.durations[row])
+
+    def extend(self, songs):
+        for title, artist, path, thumbnail, album, duration in songs:
+            self.titles.append(title)
+            self.artists.append(sys.intern(artist))
+            self.paths.append(path)
+            self.thumbnails.append(thumbnail)
+            self.albums.append(sys.intern(album))
+            self.durations.append(duration)
+            track = track_id(path)
+            self.id_rows[track] = len(self.ids)
+            self.ids.append(track)
+
+    def row_of(self, track):
+        # Rows behind a deletion are renumbered on the next lookup, once per burst of removals
+        if self.stale_from < len(self.ids):
+            for row in range(self.stale_from, len(self.ids)):
+                self.id_rows[self.ids[row]] = row
+        self.stale_from = sys.maxsize
+        return self.id_rows.get(track, -1)
+
+    def delete(self, first, last):
+        for track in self.ids[first:last + 1]:
+            del self.id_rows[track]
+        for column in (self.titles, self.artists, self.paths, self.thumbnails, self.albums, self.durations, self.ids):
+            del column[first:last + 1]
+        self.stale_from = min(self.stale_from, first)
+
+    def clear(self):
+        self.titles.clear()
+        self.artists.clear()
+        self.paths.clear()
+        self.thumbnails.clear()
+        self.albums.clear()
+        self.durations.clear()
+        self.ids.clear()
+        self.id_rows.clear()
+        self.stale_from = sys.maxsize
+
+class PlaylistModel(QAbstractListModel):
+    def __init__(self, table, parent=None):
+        super().__init__(parent)
+        self.table = table
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.table)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and index.isValid():
+            row = index.row()
+            return f"{self.table.titles[row]} - {self.table.artists[row]}"
+        return None
+
+    def append_songs(self, songs):
+        if not songs:
+            return
+        first = len(self.table)
+        self.beginInsertRows(QModelIndex(), first, first + len(songs) - 1)
+        self.table.extend(songs)
+        self.endInsertRows()
+
+    def remove_rows(self, rows):
+        # Contiguous runs are removed bottom-up so the row numbers of earlier runs stay valid
+        runs = []
+        for row in sorted(rows):
+            if runs and runs[-1][1] == row - 1:
+                runs[-1][1] = row
+            else:
+                runs.append([row, row])
+        for first, last in reversed(runs):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            self.table.delete(first, last)
+            self.endRemoveRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.table.clear()
+        self.endResetModel()
+
+### --- PLAYLIST SEARCH --- ###
+class SearchIndex:
+    # Trigram postings over case-folded, accent-stripped "title artist" keys
+    FOLD = str.maketrans({'đ': 'd', 'Đ': 'D', 'ø': 'o', 'Ø': 'O', 'ł': 'l', 'Ł': 'L', 'æ': 'ae', 'Æ': 'AE'})
+    EMPTY = array('i')
+    # Trigrams found in more than this share of the rows narrow too little to be worth reading
+    SCAN_FRACTION = 8
+
+    def __init__(self):
+        # Postings hold slots that never move, so deleting playlist rows only renumbers slot_rows
+        self.keys = []
+        self.row_slots = []
+        self.slot_rows = []
+        self.trigrams = {}
+
+    @classmethod
+    def normalize(cls, text):
+        text = unicodedata.normalize('NFKD', text.translate(cls.FOLD))
+        return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+    def extend(self, titles, artists):
+        trigrams = self.trigrams
+        for title, artist in zip(titles, artists):
+            slot = len(self.slot_rows)
+            key = self.normalize(f"{title} {artist}")
+            self.slot_rows.append(len(self.keys))
+            self.row_slots.append(slot)
+            self.keys.append(key)
+            for trigram in {key[i:i + 3] for i in range(len(key) - 2)}:
+                postings = trigrams.get(trigram)
+                if postings is None:
+                    postings = trigrams[trigram] = array('i')
+                postings.append(slot)
+
+    def remove(self, first, last):
+        for slot in self.row_slots[first:last + 1]:
+            self.slot_rows[slot] = -1
+        del self.keys[first:last + 1]
+        del self.row_slots[first:last + 1]
+        for row in range(first, len(self.row_slots)):
+            self.slot_rows[self.row_slots[row]] = row
+
+    def clear(self):
+        self.keys = []
+        self.row_slots = []
+        self.slot_rows = []
+        self.trigrams = {}
+
+    def search(self, words, within=None):
+        # Rows come back in playlist order; the rarest trigram's posting gives the candidates, which still
+        # need a substring check. Slots are handed out in playlist order and removals keep that order, so
+        # candidates never need sorting
+        keys = self.keys
+        rows = within
+        if rows is None:
+            rarest = min((self.trigrams.get(word[i:i + 3], self.EMPTY) for word in words for i in range(len(word) - 2)),
+                         key=len, default=None)
+            if rarest is not None and len(rarest) * self.SCAN_FRACTION < len(keys):
+                rows = [row for row in map(self.slot_rows.__getitem__, rarest) if row != -1]
+            else:
+                # Broad queries ("artist 5") match most rows; one pass over the keys beats collecting candidates
+                rows = range(len(keys))
+        for word in words:
+            rows = [row for row in rows if word in keys[row]]
+        return list(rows)
+
+class PlaylistFilterModel(QAbstractProxyModel):
+    # Maps visible rows onto playlist rows; an empty query shows the playlist unfiltered
+    INDEX_CHUNK = 500
+    indexing_finished = Signal()
+
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        self.search_index = SearchIndex()
+        self.words = []
+        self.rows = None
+        # Source rows below size are indexed and mapped; the rest are still waiting for index_timer
+        self.size = 0
+        self.removing = (0, 0)
+        self.setSourceModel(source)
+        source.rowsInserted.connect(self.on_rows_inserted)
+        source.rowsAboutToBeRemoved.connect(self.on_rows_about_to_be_removed)
+        source.rowsRemoved.connect(self.on_rows_removed)
+        source.modelReset.connect(self.on_model_reset)
+        # An already loaded library is indexed in slices between events, so opening the player never stalls the GUI
+        self.index_timer = QTimer(self)
+        self.index_timer.setInterval(0)
+        self.index_timer.timeout.connect(self.index_next_chunk)
+        if source.rowCount():
+            self.index_timer.start()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else (self.size if self.rows is None else len(self.rows))
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 1
+
+    def index(self, row, column=0, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < self.rowCount()) or column != 0:
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def mapToSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        row = index.row() if self.rows is None else self.rows[index.row()]
+        return self.sourceModel().index(row)
+
+    def mapFromSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        row = index.row()
+        if self.rows is not None:
+            position = bisect_left(self.rows, row)
+            if position == len(self.rows) or self.rows[position] != row:
+                return QModelIndex()
+            row = position
+        return self.index(row)
+
+    def set_query(self, text):
+        words = SearchIndex.normalize(text).split()
+        if words == self.words:
+            return
+        # A query that only extends the previous one narrows the previous result, and only the words
+        # that changed need checking again
+        refine = self.rows is not None and bool(self.words) and ' '.join(words).startswith(' '.join(self.words))
+        self.beginResetModel()
+        if not words:
+            self.rows = None
+        elif refine:
+            changed = [word for position, word in enumerate(words) if position >= len(self.words) or word != self.words[position]]
+            self.rows = self.search_index.search(changed, self.rows)
+        else:
+            self.rows = self.search_index.search(words)
+        self.words = words
+        self.endResetModel()
+
+    def index_next_chunk(self):
+        total = self.sourceModel().rowCount()
+        if self.size < total:
+            self.index_rows(self.size, min(total, self.size + self.INDEX_CHUNK) - 1)
+        if self.size >= total:
+            self.index_timer.stop()
+            self.indexing_finished.emit()
+
+    def on_rows_inserted(self, parent, first, last):
+        # Rows appended behind a backlog are picked up by index_timer in order
+        if first == self.size:
+            self.index_rows(first, last)
+
+    def index_rows(self, first, last):
+        table = self.sourceModel().table
+        self.search_index.extend(table.titles[first:last + 1], table.artists[first:last + 1])
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), self.size, self.size + last - first)
+            self.size = last + 1
+            self.endInsertRows()
+            return
+        self.size = last + 1
+        matches = self.search_index.search(self.words, range(first, last + 1))
+        if matches:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(matches) - 1)
+            self.rows.extend(matches)
+            self.endInsertRows()
+
+    def on_rows_about_to_be_removed(self, parent, first, last):
+        if self.rows is None:
+            self.removing = (min(first, self.size), min(last + 1, self.size))
+        else:
+            self.removing = (bisect_left(self.rows, first), bisect_left(self.rows, last + 1))
+        start, end = self.removing
+        if end > start:
+            self.beginRemoveRows(QModelIndex(), start, end - 1)
+
+    def on_rows_removed(self, parent, first, last):
+        count = last - first + 1
+        indexed = max(0, min(last + 1, self.size) - first)
+        if indexed:
+            self.search_index.remove(first, first + indexed - 1)
+        self.size -= indexed
+        start, end = self.removing
+        if self.rows is not None:
+            self.rows[start:] = [row - count for row in self.rows[end:]]
+        if end > start:
+            self.endRemoveRows()
+
+    def on_model_reset(self):
+        self.beginResetModel()
+        self.index_timer.stop()
+        self.search_index.clear()
+        self.size = 0
+        if self.rows is not None:
+            self.rows = []
+        self.endResetModel()
+
+### --- MUSIC LIBRARY INDEX --- ###
+class LibraryIndex:
+    SCHEMA_VERSION = 3
+    MEMORY_URI = "file:library-index?mode=memory&cache=shared"
+    # Holds the in-memory fallback open between scans, otherwise every update scan would start from an empty index
+    memory_keepalive = None
+
+    def __init__(self, db_path="library.db"):
+        # The index is only a cache of the music folder: a corrupt file is thrown away and rebuilt, and
+        # without a usable file (read-only folder, locked by another instance) the scan works from memory
+        try:
+            self._open(db_path)
+        except sqlite3.OperationalError:
+            if LibraryIndex.memory_keepalive is None:
+                LibraryIndex.memory_keepalive = sqlite3.connect(self.MEMORY_URI, uri=True, check_same_thread=False)
+            self._open(self.MEMORY_URI, uri=True)
+        except sqlite3.DatabaseError:
+            for path in (db_path, db_path + "-journal", db_path + "-wal"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._open(db_path)
+
+    def _open(self, db_path, uri=False):
+        self.conn = sqlite3.connect(db_path, timeout=10, uri=uri)
+        try:
+            self._create_schema()
+        except sqlite3.DatabaseError:
+            self.conn.close()
+            raise
+
+    def _create_schema(self):
+        # An outdated schema is simply rebuilt
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self.conn.executescript(f"""
+                DROP TABLE IF EXISTS songs;
+                DROP TABLE IF EXISTS folders;
+                DROP TABLE IF EXISTS tags;
+                PRAGMA user_version = {self.SCHEMA_VERSION};
+            """)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, subfolders TEXT NOT NULL DEFAULT '[]');
+            CREATE TABLE IF NOT EXISTS songs (folder TEXT NOT NULL, path TEXT NOT NULL, title TEXT, artist TEXT, thumbnail TEXT,
+                                              album TEXT NOT NULL DEFAULT '', duration INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS songs_folder ON songs (folder);
+            CREATE TABLE IF NOT EXISTS tags (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, size INTEGER NOT NULL,
+                                             title TEXT, artist TEXT, album TEXT, duration INTEGER, cover TEXT);
+        """)
+
+    def load(self):
+        folders = {path: (mtime, [], json.loads(subfolders))
+                   for path, mtime, subfolders in self.conn.execute("SELECT path, mtime, subfolders FROM folders")}
+        for folder, *song in self.conn.execute("SELECT folder, title, artist, path, thumbnail, album, duration FROM songs ORDER BY rowid"):
+            if folder in folders:
+                folders[folder][1].append(Song(*song))
+        return folders
+
+    def store_folder(self, folder, mtime, songs, subfolders):
+        self.conn.execute("DELETE FROM songs WHERE folder = ?", (folder,))
+        self.conn.execute("INSERT OR REPLACE INTO folders (path, mtime, subfolders) VALUES (?, ?, ?)",
+                          (folder, mtime, json.dumps(subfolders)))
+        self.conn.executemany("INSERT INTO songs (folder, title, artist, path, thumbnail, album, duration) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              [(folder, *song) for song in songs])
+
+    def remove_folders(self, folders):
+        self.conn.executemany("DELETE FROM songs WHERE folder = ?", [(f,) for f in folders])
+        self.conn.executemany("DELETE FROM folders WHERE path = ?", [(f,) for f in folders])
+        self.conn.executemany("DELETE FROM tags WHERE substr(path, 1, length(?)) = ?",
+                              [(f + os.sep,) * 2 for f in folders])
+
+    def load_tags(self):
+        return {path: (mtime, size, Tags(*tags)) for path, mtime, size, *tags in
+                self.conn.execute("SELECT path, mtime, size, title, artist, album, duration, cover FROM tags")}
+
+    def store_tags(self, path, mtime, size, tags):
+        self.conn.execute("INSERT OR REPLACE INTO tags (path, mtime, size, title, artist, album, duration, cover) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          (path, mtime, size, *tags))
+
+    def prune_tags(self):
+        self.conn.execute("DELETE FROM tags WHERE path NOT IN (SELECT path FROM songs)")
+
+    def cover_paths(self):
+        # Embedded covers still in use: shown as a track's thumbnail, or kept for a track whose folder has its own art
+        return [path for path, in self.conn.execute(
+            "SELECT thumbnail FROM songs WHERE thumbnail IS NOT NULL UNION SELECT cover FROM tags WHERE cover IS NOT NULL")]
+
+    def clear(self):
+        self.conn.execute("DELETE FROM songs")
+        self.conn.execute("DELETE FROM folders")
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+### --- TAG READER --- ###
+Tags = namedtuple("Tags", ["title", "artist", "album", "duration", "cover"])
+
+class TagReader:
+    # Reads ID3v1/ID3v2 tags and the first MPEG frame header without decoding any audio
+    MAX_TAG_BYTES = 16 * 1024 * 1024
+    SYNC_WINDOW = 8 * 1024
+    TEXT_FRAMES = {'TIT2': 'title', 'TT2': 'title', 'TPE1': 'artist', 'TP1': 'artist',
+                   'TALB': 'album', 'TAL': 'album', 'TLEN': 'length', 'TLE': 'length'}
+    ENCODINGS = ['latin-1', 'utf-16', 'utf-16-be', 'utf-8']
+    BITRATES = {
+        (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+        (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    }
+    SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+    def __init__(self, cover_dir="cover-cache"):
+        self.cover_dir = cover_dir
+
+    def read(self, path):
+        fields, picture = {}, None
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            header = f.read(10)
+            audio_start = 0
+            if len(header) == 10 and header[:3] == b'ID3' and header[3] in (2, 3, 4):
+                tag_size = self._syncsafe(header[6:10])
+                audio_start = 10 + tag_size + (10 if header[5] & 0x10 else 0)
+                if tag_size <= self.MAX_TAG_BYTES:
+                    fields, picture = self._parse_v2(header, f.read(tag_size))
+            f.seek(audio_start)
+            duration = self._frame_duration(f.read(self.SYNC_WINDOW), file_size - audio_start)
+            if file_size >= 128 and not (fields.get('title') and fields.get('artist')):
+                f.seek(file_size - 128)
+                for key, value in self._parse_v1(f.read(128)).items():
+                    fields.setdefault(key, value)
+
+        length = fields.get('length', '')
+        if length.isdigit() and int(length) > 0:
+            duration = int(length)
+        cover = self._store_cover(picture) if picture else None
+        return Tags(fields.get('title', ''), fields.get('artist', ''), fields.get('album', ''), duration, cover)
+
+    @staticmethod
+    def _syncsafe(data):
+        return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+    def _parse_v2(self, header, tag):
+        version, flags = header[3], header[5]
+        if version < 4 and flags & 0x80:
+            tag = tag.replace(b'\xff\x00', b'\xff')
+        pos = 0
+        if flags & 0x40 and version >= 3:
+            ext_size = int.from_bytes(tag[:4], 'big')
+            pos = self._syncsafe(tag[:4]) if version == 4 else ext_size + 4
+
+        id_len, header_len = (3, 6) if version == 2 else (4, 10)
+        fields, pictures = {}, []
+        while pos + header_len <= len(tag):
+            frame_id = tag[pos:pos + id_len]
+            if not frame_id.strip(b'\0') or not frame_id.isalnum():
+                break
+            size_bytes = tag[pos + id_len:pos + id_len + (3 if version == 2 else 4)]
+            size = self._syncsafe(size_bytes) if version == 4 else int.from_bytes(size_bytes, 'big')
+            format_flags = tag[pos + 9] if version >= 3 else 0
+            body = tag[pos + header_len:pos + header_len + size]
+            pos += header_len + size
+            if version == 4 and format_flags & 0x02:
+                body = body.replace(b'\xff\x00', b'\xff')
+            if version == 4 and format_flags & 0x01:
+                body = body[4:]
+            frame_id = frame_id.decode('latin-1')
+            if frame_id in self.TEXT_FRAMES and body:
+                fields.setdefault(self.TEXT_FRAMES[frame_id], self._decode_text(body[0], body[1:]))
+            elif frame_id in ('APIC', 'PIC') and body:
+                picture = self._parse_picture(frame_id, body)
+                if picture:
+                    pictures.append(picture)
+
+        # Prefer the front cover (picture type 3) over any other embedded image
+        pictures.sort(key=lambda picture: picture[0] != 3)
+        return {key: value for key, value in fields.items() if value}, (pictures[0][1:] if pictures else None)
+
+    def _decode_text(self, encoding, data):
+        if encoding >= len(self.ENCODINGS):
+            return ''
+        # ID3v2.4 separates multiple values with NULs; only the first one is kept
+        text = data.decode(self.ENCODINGS[encoding], errors='replace')
+        return text.split('\0', 1)[0].strip()
+
+    def _parse_picture(self, frame_id, body):
+        encoding = body[0]
+        if frame_id == 'PIC':
+            mime = 'image/png' if body[1:4].upper() == b'PNG' else 'image/jpeg'
+            pos = 4
+        else:
+            mime_end = body.find(b'\0', 1)
+            if mime_end < 0:
+                return None
+            mime = body[1:mime_end].decode('latin-1').lower()
+            pos = mime_end + 1
+        if pos >= len(body):
+            return None
+        picture_type = body[pos]
+        pos += 1
+        if encoding in (1, 2):
+            while pos + 1 < len(body) and body[pos:pos + 2] != b'\0\0':
+                pos += 2
+            pos += 2
+        else:
+            end = body.find(b'\0', pos)
+            pos = (end if end >= 0 else len(body)) + 1
+        data = body[pos:]
+        return (picture_type, mime, data) if data else None
+
+    @staticmethod
+    def _parse_v1(data):
+        if data[:3] != b'TAG':
+            return {}
+        fields = {}
+        for key, start in (('title', 3), ('artist', 33), ('album', 63)):
+            value = data[start:start + 30].split(b'\0', 1)[0].decode('latin-1').strip()
+            if value:
+                fields[key] = value
+        return fields
+
+    def _frame_duration(self, data, audio_bytes):
+        # Finds the first MPEG audio frame; a Xing/Info or VBRI header gives the exact frame
+        # count for VBR files, otherwise the length is estimated from the constant bitrate
+        for i in range(len(data) - 4):
+            if data[i] != 0xFF or data[i + 1] & 0xE0 != 0xE0:
+                continue
+            version_bits, layer_bits = (data[i + 1] >> 3) & 3, (data[i + 1] >> 1) & 3
+            bitrate_index, rate_index = data[i + 2] >> 4, (data[i + 2] >> 2) & 3
+            if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+                continue
+            version, layer = (1 if version_bits == 3 else 2), 4 - layer_bits
+            sample_rate = self.SAMPLE_RATES[version_bits][rate_index]
+            bitrate = self.BITRATES[(version, layer)][bitrate_index] * 1000
+            samples_per_frame = 384 if layer == 1 else (576 if layer == 3 and version == 2 else 1152)
+            mono = (data[i + 3] >> 6) == 3
+
+            xing = i + 4 + ((17 if mono else 32) if version == 1 else (9 if mono else 17))
+            if data[xing:xing + 4] in (b'Xing', b'Info') and data[xing + 7] & 1:
+                frames = int.from_bytes(data[xing + 8:xing + 12], 'big')
+                return frames * samples_per_frame * 1000 // sample_rate
+            if data[i + 36:i + 40] == b'VBRI':
+                frames = int.from_bytes(data[i + 50:i + 54], 'big')
+                return frames * samples_per_frame * 1000 // sample_rate
+            return audio_bytes * 8 * 1000 // bitrate
+        return 0
+
+    def _store_cover(self, picture):
+        mime, data = picture
+        extension = '.png' if 'png' in mime else '.jpg'
+        name = hashlib.sha1(data).hexdigest() + extension
+        cover_path = os.path.join(self.cover_dir, name)
+        # Identical artwork embedded in every track of an album is written once
+        if not os.path.exists(cover_path):
+            # Without a writable cover cache the track keeps its text tags and simply has no embedded art
+            temp_path = cover_path + ".tmp"
+            try:
+                os.makedirs(self.cover_dir, exist_ok=True)
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, cover_path)
+            except OSError:
+                return None
+        return cover_path
+
+### --- BACKGROUND LIBRARY SCANNER --- ###
+class LibraryScanSignals(QObject):
+    songs_found = Signal(list)
+    library_changed = Signal(list, list)
+    finished = Signal()
+
+class LibraryScanner(QRunnable):
+    BATCH_SIZE = 200
+    AUDIO_EXTENSIONS = {'.mp3', '.flac', '.ogg', '.oga', '.opus', '.m4a', '.aac', '.wav', '.wma'}
+    COVER_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.jfif'}
+    COVER_NAMES = ['thumbnail', 'cover', 'folder', 'front', 'album']
+    SETTLE_SECONDS = 2
+
+    def __init__(self, music_dir="./music", db_path="library.db", full_rescan=False, folders=None):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.music_dir = Path(music_dir)
+        self.db_path = db_path
+        self.full_rescan = full_rescan
+        # With `folders` set only those folders are re-read and the difference is reported
+        self.folders = folders
+        self.scanned_folders = []
+        # Folders holding files that may still be copying; they are stored as stale and read again later
+        self.unsettled_folders = set()
+        self.cancelled = False
+        self.signals = LibraryScanSignals()
+        self.tag_reader = TagReader()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        # finished is always emitted, otherwise the controller would wait on this scanner forever
+        try:
+            if self.music_dir.exists():
+                # SQLite connections are bound to the thread that opened them
+                library_index = LibraryIndex(self.db_path)
+                try:
+                    if self.folders is None:
+                        with tracer.phase("library scan"):
+                            self._scan(library_index)
+                    else:
+                        self._update(library_index)
+                finally:
+                    library_index.close()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error scanning music library: {e}")
+        finally:
+            self.signals.finished.emit()
+
+    def _scan(self, library_index):
+        # Only folders whose mtime, or the size or mtime of one of their tagged tracks, changed since
+        # the last launch are listed and have their tracks examined again
+        if self.full_rescan:
+            library_index.clear()
+        indexed = library_index.load()
+        self.tag_cache = library_index.load_tags()
+
+        root = str(self.music_dir)
+        root_stat = os.stat(root)
+        visited = {(root_stat.st_dev, root_stat.st_ino)}
+        batch = []
+        for songs in self._walk([(root, root_stat.st_mtime_ns)], indexed, library_index, visited):
+            batch.extend(songs)
+            if len(batch) >= self.BATCH_SIZE:
+                self.signals.songs_found.emit(batch)
+                batch = []
+        if self.cancelled:
+            library_index.commit()
+            return
+
+        if batch:
+            self.signals.songs_found.emit(batch)
+        library_index.remove_folders(indexed.keys())
+        library_index.prune_tags()
+        library_index.commit()
+        self.prune_covers(library_index)
+
+    def _update(self, library_index):
+        # Parents are handled before their children, and a folder already walked as part
+        # of a new parent is not read twice
+        indexed = library_index.load()
+        self.tag_cache = library_index.load_tags()
+        removed, added = [], []
+        for folder in sorted(self.folders):
+            if self.cancelled:
+                break
+            if folder in self.scanned_folders:
+                continue
+            nested = [f for f in indexed if f.startswith(folder + os.sep)]
+            if not os.path.isdir(folder):
+                gone = nested + ([folder] if folder in indexed else [])
+            else:
+                mtime = os.stat(folder).st_mtime_ns
+                entries, children = self._list_folder(folder)
+                if entries is None:
+                    continue
+                self.scanned_folders.append(folder)
+                subfolders = self._follow(children, set())
+                songs = self.examine_folder(folder, entries, library_index)
+                library_index.store_folder(folder, 0 if folder in self.unsettled_folders else mtime, songs,
+                                           [os.path.basename(path) for path, _ in children])
+                old_paths = {song.path for song in indexed.pop(folder, (0, [], []))[1]}
+                removed.extend(old_paths - {song.path for song in songs})
+                added.extend(song for song in songs if song.path not in old_paths)
+
+                # New subfolders are walked in full; vanished ones take their whole subtree with them
+                children = {path for path, _ in subfolders}
+                gone = [f for f in nested if os.path.join(folder, os.path.relpath(f, folder).split(os.sep)[0]) not in children]
+                new_folders = [(path, mtime) for path, mtime in subfolders if path not in indexed]
+                for songs in self._walk(new_folders, {}, library_index, set()):
+                    added.extend(songs)
+
+            for f in gone:
+                removed.extend(song.path for song in indexed.pop(f)[1])
+            library_index.remove_folders(gone)
+
+        library_index.commit()
+        if removed or added:
+            self.signals.library_changed.emit(removed, added)
+
+    def _walk(self, roots, indexed, library_index, visited):
+        # A folder with an unchanged mtime still holds the same entries: its tracks and subfolder names
+        # come from the index and only the subfolders are stat()ed, so a warm start lists no folder at all
+        stack = list(reversed(roots))
+        while stack and not self.cancelled:
+            folder, mtime = stack.pop()
+            cached = indexed.get(folder)
+            # Tags edited in place leave the folder mtime alone, so tagged tracks are checked one by one
+            if cached and cached[0] == mtime and self._tags_unchanged(cached[1]):
+                songs, children = cached[1], self._stat_children(folder, cached[2])
+            else:
+                entries, children = self._list_folder(folder)
+                if entries is None:
+                    continue
+                songs = self.examine_folder(folder, entries, library_index)
+                library_index.store_folder(folder, 0 if folder in self.unsettled_folders else mtime, songs,
+                                           [os.path.basename(path) for path, _ in children])
+            indexed.pop(folder, None)
+            self.scanned_folders.append(folder)
+            stack.extend(reversed(self._follow(children, visited)))
+            yield songs
+
+    def _tags_unchanged(self, songs):
+        for song in songs:
+            cached = self.tag_cache.get(song.path)
+            if cached is None:
+                continue
+            try:
+                stat = os.stat(song.path)
+            except OSError:
+                return False
+            if cached[:2] != (stat.st_mtime_ns, stat.st_size):
+                return False
+        return True
+
+    def prune_covers(self, library_index):
+        # Embedded artwork that no track in the library refers to any more is deleted after a complete scan
+        in_use = {os.path.abspath(path) for path in library_index.cover_paths()}
+        try:
+            with os.scandir(self.tag_reader.cover_dir) as entries:
+                stale = [entry.path for entry in entries if os.path.abspath(entry.path) not in in_use]
+        except OSError:
+            return
+        for path in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _list_folder(folder):
+        try:
+            with os.scandir(folder) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError:
+            return None, []
+
+        children = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    children.append((entry.path, entry.stat()))
+            except OSError:
+                continue
+        return entries, children
+
+    @staticmethod
+    def _stat_children(folder, names):
+        children = []
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                children.append((path, os.stat(path)))
+            except OSError:
+                continue
+        return children
+
+    @staticmethod
+    def _follow(children, visited):
+        # Symlinked folders are followed, but each real folder is walked once
+        subfolders = []
+        for path, stat in children:
+            if (stat.st_dev, stat.st_ino) not in visited:
+                visited.add((stat.st_dev, stat.st_ino))
+                subfolders.append((path, stat.st_mtime_ns))
+        return subfolders
+
+    def examine_folder(self, folder, entries, library_index):
+        tracks, covers = [], {}
+        now = time.time()
+        for entry in entries:
+            stem, extension = os.path.splitext(entry.name)
+            extension = extension.lower()
+            if extension in self.AUDIO_EXTENSIONS:
+                # A file written in the last moments may be half copied; its tags are not read until it settles
+                try:
+                    age = now - entry.stat().st_mtime
+                except OSError:
+                    continue
+                if 0 <= age < self.SETTLE_SECONDS:
+                    self.unsettled_folders.add(folder)
+                    continue
+                tracks.append((entry, stem, extension))
+            elif extension in self.COVER_EXTENSIONS and stem.lower() in self.COVER_NAMES:
+                covers[stem.lower()] = entry.path
+
+        # Folder-level cover art is shared by every track inside the folder
+        folder_cover = next((covers[name] for name in self.COVER_NAMES if name in covers), None)
+        songs = []
+        for entry, stem, extension in tracks:
+            tags = self.read_tags(entry, library_index) if extension == '.mp3' else Tags('', '', '', 0, None)
+            title, artist = self.parse_filename(stem)
+            thumbnail = folder_cover or tags.cover
+            songs.append(Song(tags.title or title, tags.artist or artist, entry.path, thumbnail, tags.album, tags.duration))
+        return songs
+
+    @staticmethod
+    def parse_filename(stem):
+        title, artist = "Unknown Title", "Unknown Artist"
+        if '_' in stem:
+            parts = stem.split('_', 1)
+            title = parts[0].replace('-', ' ')
+            if len(parts) > 1:
+                artist = parts[1].replace('-', ' ')
+        else:
+            title = stem.replace('-', ' ')
+        return title, artist
+
+    def read_tags(self, entry, library_index):
+        # Files are parsed again only when their size or mtime changed since the cached read
+        path, stat = entry.path, entry.stat()
+        cached = self.tag_cache.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            tags = cached[2]
+            if not tags.cover or os.path.exists(tags.cover):
+                return tags
+        try:
+            tags = self.tag_reader.read(path)
+        except (OSError, IndexError, ValueError):
+            tags = Tags('', '', '', 0, None)
+        library_index.store_tags(path, stat.st_mtime_ns, stat.st_size, tags)
+        self.tag_cache[path] = (stat.st_mtime_ns, stat.st_size, tags)
+        return tags
+
+### --- THUMBNAIL PIPELINE --- ###
+class ThumbnailDiskCache:
+    def __init__(self, directory="thumbnail-cache", max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def entry_path(self, source, size):
+        # Keyed by source path, mtime and target size so edited cover art gets a fresh entry
+        try:
+            mtime = os.stat(source).st_mtime_ns
+        except OSError:
+            return None
+        key = f"{os.path.abspath(source)}|{mtime}|{size.width()}x{size.height()}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".png")
+
+    # These run on worker threads; a cache that cannot be read or written (full disk, permissions,
+    # an entry pruned meanwhile) only means the cover is decoded from its source again
+    def load(self, entry):
+        if not os.path.exists(entry):
+            return None
+        image = QImage(entry)
+        if image.isNull():
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return image
+
+    def store(self, entry, image):
+        temp_path = entry + ".tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if image.save(temp_path, "PNG"):
+                os.replace(temp_path, entry)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def prune(self):
+        # Least recently used entries go first once the cache outgrows its budget
+        files = []
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            files.append((stat.st_mtime, stat.st_size, entry.path))
+                    except OSError:
+                        continue
+        except OSError:
+            return
+        files.sort(reverse=True)
+        total = 0
+        for _, size, path in files:
+            total += size
+            if total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+class ThumbnailSignals(QObject):
+    loaded = Signal(str, QImage)
+
+class ThumbnailJob(QRunnable):
+    def __init__(self, path, size, disk_cache, signals):
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.disk_cache = disk_cache
+        self.signals = signals
+
+    def run(self):
+        entry = self.disk_cache.entry_path(self.path, self.size)
+        image = self.disk_cache.load(entry) if entry else None
+        if image is None:
+            # Let the decoder downscale while reading instead of decoding full-size cover art
+            reader = QImageReader(self.path)
+            reader.setAutoTransform(True)
+            source_size = reader.size()
+            if source_size.isValid():
+                reader.setScaledSize(source_size.scaled(self.size, Qt.AspectRatioMode.KeepAspectRatio))
+            image = reader.read()
+            if entry and not image.isNull():
+                self.disk_cache.store(entry, image)
+        self.signals.loaded.emit(self.path, image)
+
+class ThumbnailLoader(QObject):
+    thumbnail_ready = Signal(str, QPixmap)
+
+    def __init__(self, size=QSize(100, 100), budget_bytes=32 * 1024 * 1024, parent=None):
+        super().__init__(parent)
+        self.size = size
+        self.budget_bytes = budget_bytes
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.pending = set()
+        self.disk_cache = ThumbnailDiskCache()
+        self.signals = ThumbnailSignals()
+        self.signals.loaded.connect(self._store)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.pool.start(self.disk_cache.prune)
+
+    def get(self, path):
+        entry = self.cache.get(path)
+        if entry is None:
+            return None
+        self.cache.move_to_end(path)
+        return entry[0]
+
+    def request(self, path):
+        if path in self.cache or path in self.pending:
+            return
+        self.pending.add(path)
+        self.pool.start(ThumbnailJob(path, self.size, self.disk_cache, self.signals))
+
+    def _store(self, path, image):
+        self.pending.discard(path)
+        pixmap = QPixmap.fromImage(image)
+        self.cache[path] = (pixmap, image.sizeInBytes())
+        self.cache_bytes += image.sizeInBytes()
+        while self.cache_bytes > self.budget_bytes and len(self.cache) > 1:
+            _, (_, evicted_bytes) = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted_bytes
+        self.thumbnail_ready.emit(path, pixmap)
+
+### --- SHUFFLE ORDER --- ###
+class ShuffleOrder:
+    # A shuffled permutation of track IDs walked by a cursor: no track repeats until the whole library has played.
+    # Tracks that left the library are skipped when reached and dropped when the next cycle starts
+    HISTORY_LIMIT = 200
+
+    def __init__(self):
+        self.order = []
+        self.members = set()
+        self.pending = []
+        self.cursor = -1
+        self.history = deque(maxlen=self.HISTORY_LIMIT)
+        self.forward = []
+        self.order_changed = False
+
+    def state(self):
+        # Only the small part; the permutation itself is saved separately, and only when order_changed is set
+        return {"shuffle_cursor": self.cursor, "shuffle_history": list(self.history), "shuffle_forward": list(self.forward)}
+
+    def restore(self, state, order):
+        if not order:
+            return
+        self.order = order
+        self.members = set(order)
+        self.cursor = state.get("shuffle_cursor", -1)
+        self.history.extend(state.get("shuffle_history", []))
+        self.forward = state.get("shuffle_forward", [])
+
+    def add(self, tracks):
+        # New tracks join the part of the cycle that has not played yet on the next peek
+        for track in tracks:
+            if track not in self.members:
+                self.members.add(track)
+                self.pending.append(track)
+
+    def peek(self, table):
+        if self.pending:
+            remaining = self.order[self.cursor + 1:] + self.pending
+            shuffle(remaining)
+            self.order[self.cursor + 1:] = remaining
+            self.pending = []
+            self.order_changed = True
+        while self.forward and self.forward[-1] not in table:
+            self.forward.pop()
+        if self.forward:
+            return self.forward[-1]
+        while True:
+            if self.cursor + 1 >= len(self.order):
+                self._start_cycle(table)
+                if not self.order:
+                    return None
+            if self.order[self.cursor + 1] in table:
+                return self.order[self.cursor + 1]
+            self.cursor += 1
+
+    def advance(self, current, table):
+        upcoming = self.peek(table)
+        if upcoming is None:
+            return None
+        if current is not None:
+            self.history.append(current)
+        if self.forward:
+            self.forward.pop()
+        else:
+            self.cursor += 1
+        return upcoming
+
+    def back(self, current, table):
+        while self.history:
+            previous = self.history.pop()
+            if previous in table:
+                if current is not None:
+                    self.forward.append(current)
+                return previous
+        return None
+
+    def jump(self, current):
+        if current is not None:
+            self.history.append(current)
+        self.forward = []
+
+    def _start_cycle(self, table):
+        last = self.order[self.cursor] if 0 <= self.cursor < len(self.order) else None
+        order = [track for track in self.order if track in table]
+        shuffle(order)
+        if len(order) > 1 and order[0] == last:
+            order[0], order[-1] = order[-1], order[0]
+        self.order = order
+        self.members = set(order)
+        self.cursor = -1
+        self.order_changed = True
+
+### --- PLAY QUEUE --- ###
+class PlayQueue:
+    # Tracks queued by hand play before the playback mode picks the next one. The OrderedDict is a linked
+    # list keyed by track ID, so adding at either end, taking the head and removing any track are all O(1)
+    def __init__(self, tracks=()):
+        self.tracks = OrderedDict.fromkeys(tracks)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __contains__(self, track):
+        return track in self.tracks
+
+    def enqueue(self, track):
+        self.tracks[track] = None
+        self.tracks.move_to_end(track)
+
+    def play_next(self, track):
+        self.tracks[track] = None
+        self.tracks.move_to_end(track, last=False)
+
+    def remove(self, track):
+        self.tracks.pop(track, None)
+
+    def state(self):
+        return list(self.tracks)
+
+### --- SESSION PERSISTENCE --- ###
+class SessionStore(QObject):
+    DEBOUNCE_MS = 1500
+
+    def __init__(self, path="config.json", parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.backup_path = path + ".bak"
+        self.state = self.load()
+        # Bursts of changes (e.g. dragging the volume slider) collapse into one write
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.timeout.connect(self._write_in_background)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def load(self):
+        # An interrupted or corrupted write falls back to the last known good snapshot
+        for path in (self.path, self.backup_path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    return data
+            except (OSError, ValueError):
+                continue
+        return {}
+
+    def update(self, **changes):
+        if all(self.state.get(key) == value for key, value in changes.items()):
+            return
+        self.state.update(changes)
+        self.debounce_timer.start(self.DEBOUNCE_MS)
+
+    def flush(self):
+        self.debounce_timer.stop()
+        self.pool.waitForDone()
+        self._write(dict(self.state))
+
+    def _write_in_background(self):
+        self.pool.start(partial(self._write, dict(self.state)))
+
+    def _write(self, snapshot):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(snapshot, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self.path):
+                os.replace(self.path, self.backup_path)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving config: {e}")
+
+    def write_file(self, path, data):
+        # Bulky state that rarely changes lives in a file of its own, so config.json stays small for the checkpoints
+        self.pool.start(partial(self._write_file, path, data))
+
+    def _write_file(self, path, data):
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error saving {path}: {e}")
+
+### --- PLAYBACK ENGINE --- ###
+class PlaybackEngine(QObject):
+    # Two players: the standby one opens the upcoming track ahead of time and takes over at the boundary
+    playbackStateChanged = Signal(object)
+    positionChanged = Signal(int)
+    durationChanged = Signal(int)
+    mediaStatusChanged = Signal(object)
+    advanced = Signal()
+    FADE_STEP_MS = 50
+
+    def __init__(self, crossfade_ms=0, parent=None):
+        super().__init__(parent)
+        self.crossfade_ms = crossfade_ms
+        self.volume = 1.0
+        self.muted = False
+        self.players = []
+        tracer.begin("media backend")
+        for _ in range(2):
+            player = QMediaPlayer(self)
+            player.setAudioOutput(QAudioOutput(self))
+            player.playbackStateChanged.connect(partial(self._forward, player, self.playbackStateChanged))
+            player.durationChanged.connect(partial(self._forward, player, self.durationChanged))
+            player.positionChanged.connect(partial(self._on_position, player))
+            player.mediaStatusChanged.connect(partial(self._on_media_status, player))
+            self.players.append(player)
+        tracer.end()
+        self.active, self.standby = self.players
+        self.preloaded = False
+        self.pending_preload = None
+        self.pending_resume = None
+        self.fading_out = None
+        self.fade_elapsed = 0
+        self.fade_timer = QTimer(self)
+        self.fade_timer.setInterval(self.FADE_STEP_MS)
+        self.fade_timer.timeout.connect(self._fade_step)
+
+    ### Player Interface ###
+    def setSource(self, url):
+        self._finish_fade()
+        self.pending_resume = None
+        if self._standby_ready() and self.standby.source() == url:
+            self.active.stop()
+            self._swap()
+            self.durationChanged.emit(self.active.duration())
+        else:
+            self.active.setSource(url)
+
+    def play(self):
+        if self.pending_resume:
+            self.pending_resume = (self.pending_resume[0], True)
+            return
+        self.active.play()
+
+    def pause(self):
+        self._finish_fade()
+        if self.pending_resume:
+            self.pending_resume = (self.pending_resume[0], False)
+        self.active.pause()
+
+    def resume(self, url, position, play):
+        # Session restore: seeking and starting wait until the backend has loaded the media,
+        # so the first audio frame already comes from the saved position
+        self.setSource(url)
+        self.pending_resume = (position, play)
+        if self.active.mediaStatus() in (QMediaPlayer.MediaStatus.LoadedMedia, QMediaPlayer.MediaStatus.BufferedMedia):
+            self._apply_resume()
+
+    def _apply_resume(self):
+        position, play = self.pending_resume
+        self.pending_resume = None
+        if position > 0 and self.active.isSeekable():
+            self.active.setPosition(position)
+        if play:
+            self.active.play()
+            tracer.mark("audio_resumed")
+
+    def playbackState(self):
+        return self.active.playbackState()
+
+    def position(self):
+        return self.active.position()
+
+    def setPosition(self, position):
+        self.active.setPosition(position)
+
+    def duration(self):
+        return self.active.duration()
+
+    def setVolume(self, volume):
+        self.volume = volume
+        for player in self.players:
+            if player is not self.fading_out and not (self.fading_out and player is self.active):
+                player.audioOutput().setVolume(volume)
+
+    def setMuted(self, muted):
+        self.muted = muted
+        for player in self.players:
+            player.audioOutput().setMuted(muted)
+
+    def isMuted(self):
+        return self.muted
+
+    ### Preloading ###
+    def preload(self, url):
+        if self.standby is self.fading_out:
+            self.pending_preload = url
+            return
+        if self.standby.source() != url:
+            self.standby.setSource(url)
+        self.preloaded = True
+
+    def _standby_ready(self):
+        return self.preloaded and self.standby.mediaStatus() not in (QMediaPlayer.MediaStatus.NoMedia, QMediaPlayer.MediaStatus.InvalidMedia)
+
+    def _swap(self):
+        self.active, self.standby = self.standby, self.active
+        self.preloaded = False
+
+    def _advance(self, crossfade=False):
+        previous = self.active
+        self._swap()
+        if crossfade:
+            self.fading_out = previous
+            self.fade_elapsed = 0
+            self.active.audioOutput().setVolume(0)
+            self.fade_timer.start()
+        else:
+            previous.stop()
+        self.active.play()
+        self.durationChanged.emit(self.active.duration())
+        self.advanced.emit()
+
+    def _forward(self, player, signal, value):
+        if player is self.active:
+            signal.emit(value)
+
+    def _on_position(self, player, position):
+        if player is not self.active:
+            return
+        self.positionChanged.emit(position)
+        if self.crossfade_ms and not self.fading_out and self._standby_ready():
+            duration = player.duration()
+            if duration > self.crossfade_ms and duration - position <= self.crossfade_ms:
+                self._advance(crossfade=True)
+
+    def _on_media_status(self, player, status):
+        if player is not self.active:
+            return
+        if self.pending_resume and status in (QMediaPlayer.MediaStatus.LoadedMedia, QMediaPlayer.MediaStatus.BufferedMedia):
+            self._apply_resume()
+        elif status == QMediaPlayer.MediaStatus.InvalidMedia:
+            # The saved track could not be loaded; later play presses must reach the player again
+            self.pending_resume = None
+        if status == QMediaPlayer.MediaStatus.EndOfMedia and self._standby_ready():
+            self._advance()
+            return
+        self.mediaStatusChanged.emit(status)
+
+    ### Crossfade ###
+    def _fade_step(self):
+        self.fade_elapsed += self.FADE_STEP_MS
+        progress = min(1.0, self.fade_elapsed / self.crossfade_ms)
+        self.active.audioOutput().setVolume(self.volume * progress)
+        self.fading_out.audioOutput().setVolume(self.volume * (1.0 - progress))
+        if progress >= 1.0:
+            self._finish_fade()
+
+    def _finish_fade(self):
+        if not self.fading_out:
+            return
+        self.fade_timer.stop()
+        self.fading_out.stop()
+        for player in self.players:
+            player.audioOutput().setVolume(self.volume)
+        self.fading_out = None
+        if self.pending_preload is not None:
+            url, self.pending_preload = self.pending_preload, None
+            self.preload(url)
 
 ### --- MUSIC PLAYER --- ###
-class MusicPlayerWindow(QWidget):
-    def __init__(self, media_player, tray_actions, parent=None):
+class MusicPlayerController(QObject):
+    # Playlist, playback and session state; the tray drives this directly and the window is only a view onto it
+    CHECKPOINT_INTERVAL_MS = 5000
+    WATCH_DEBOUNCE_MS = 1000
+    SHUFFLE_ORDER_PATH = "shuffle-order.bin"
+    MODE_LABELS = {'loop_all': "Loop All", 'loop_one': "Loop One", 'shuffle': "Shuffle"}
+
+    current_changed = Signal(int)
+    mode_changed = Signal(str)
+    volume_changed = Signal()
+    scan_finished = Signal()
+
+    def __init__(self, media_player, tray_actions, session, parent=None):
         super().__init__(parent)
         self.media_player = media_player
         self.tray_actions = tray_actions
-        self.playlist = []
-        self.current_index = -1
+        self.session = session
+        self.playlist = SongTable()
+        self.playlist_model = PlaylistModel(self.playlist, self)
+        # Playback state is kept as track IDs; rows are only looked up when the view or the player needs one
+        self.current_id = None
+        self.upcoming_id = None
         self.playback_mode = 'loop_all'
         self.is_muted = False
         self.volume = 1.0
+        self.scanner = None
+        self.restore_path = None
+        self.restore_index = None
+        self.watcher = QFileSystemWatcher(self)
+        self.dirty_folders = set()
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(self.WATCH_DEBOUNCE_MS)
+        self.shuffle = ShuffleOrder()
+        self.shuffle.restore(self.session.state, self.load_shuffle_order())
+        self.queue = PlayQueue(self.session.state.get("play_queue", []))
+        self.checkpoint_timer = QTimer(self)
+        self.checkpoint_timer.setInterval(self.CHECKPOINT_INTERVAL_MS)
+
+        self.media_player.playbackStateChanged.connect(self.update_play_pause_action)
+        self.media_player.playbackStateChanged.connect(self.update_checkpoints)
+        self.media_player.mediaStatusChanged.connect(self.handle_media_status)
+        self.media_player.advanced.connect(self.show_advanced_track)
+        self.checkpoint_timer.timeout.connect(self.save_position_checkpoint)
+        self.watcher.directoryChanged.connect(self.queue_folder_update)
+        self.watch_timer.timeout.connect(self.update_library)
+        self.restore_session()
+        self.scan_music_directory()
+
+    def restore_session(self):
+        # config.json was read once by the SessionStore; volume, mute and mode are in place before any audio plays
+        state = self.session.state
+        self.volume = state.get("volume", 100) / 100.0
+        self.is_muted = bool(state.get("is_muted", False))
+        self.media_player.setVolume(self.volume)
+        self.media_player.setMuted(self.is_muted)
+        self.tray_actions['mute'].setText("Unmute" if self.is_muted else "Mute")
+        if state.get("playback_mode") in self.MODE_LABELS:
+            self.playback_mode = state["playback_mode"]
+            self.tray_actions['loop'].setText(f"Mode: {self.MODE_LABELS[self.playback_mode]}")
+
+        # The saved track starts loading right away; the scan only has to find its row afterwards.
+        # Sessions saved before tracks were stored by path fall back to the row once the scan is done
+        path = state.get("last_track_path")
+        if path and os.path.exists(path):
+            self.restore_path = path
+            self.current_id = track_id(path)
+            self.media_player.resume(QUrl.fromLocalFile(os.path.abspath(path)), state.get("last_position", 0),
+                                     state.get("was_playing", False))
+        elif path is None and state.get("last_track_index", -1) >= 0:
+            self.restore_index = state["last_track_index"]
+
+    ### Music Directory Scanner ###
+    def scan_music_directory(self, full_rescan=False):
+        if self.scanner:
+            self.scanner.cancel()
+        self.playlist_model.clear()
+
+        # Songs arrive in batches from a worker thread so the pet and tray never wait on the disk
+        self.scanner = LibraryScanner(full_rescan=full_rescan)
+        self.scanner.signals.songs_found.connect(partial(self.add_scanned_songs, self.scanner))
+        self.scanner.signals.finished.connect(partial(self.finish_scan, self.scanner))
+        QThreadPool.globalInstance().start(self.scanner)
+
+    def add_scanned_songs(self, scanner, songs):
+        if scanner is not self.scanner:
+            return
+        first = len(self.playlist)
+        self.playlist_model.append_songs(songs)
+        self.shuffle.add(self.playlist.ids[first:])
+        if self.restore_path is not None and self.current_id in self.playlist:
+            self.restore_path = None
+            self.adopt_current()
+
+    def adopt_current(self):
+        # The track is already loaded in the player; only the bookkeeping catches up
+        self.prefetch_upcoming()
+        self.current_changed.emit(self.current_row())
+
+    def finish_scan(self, scanner):
+        if scanner is not self.scanner:
+            return
+        self.scanner = None
+        if self.restore_index is not None:
+            index, self.restore_index = self.restore_index, None
+            if self.current_id is None and 0 <= index < len(self.playlist):
+                state = self.session.state
+                self.current_id = self.playlist.ids[index]
+                self.media_player.resume(self.track_url(index), state.get("last_position", 0), state.get("was_playing", False))
+                self.adopt_current()
+        if scanner.folders is None:
+            # Queued tracks that are no longer in the library are dropped once the whole folder has been read
+            self.drop_from_queue([track for track in self.queue if track not in self.playlist])
+        watched = set(self.watcher.directories())
+        new_folders = [folder for folder in scanner.scanned_folders if folder not in watched]
+        if new_folders:
+            self.watcher.addPaths(new_folders)
+        # Folders with files still being copied are checked again until they settle
+        self.dirty_folders.update(scanner.unsettled_folders)
+        if self.dirty_folders:
+            self.watch_timer.start()
+        self.scan_finished.emit()
+
+    def queue_folder_update(self, folder):
+        # Bursts of changes (a whole album being copied in) collapse into one update
+        self.dirty_folders.add(folder)
+        self.watch_timer.start()
+
+    def update_library(self):
+        if self.scanner:
+            # finish_scan picks the queued folders up once the running scan is done
+            return
+        folders, self.dirty_folders = self.dirty_folders, set()
+        self.scanner = LibraryScanner(folders=folders)
+        self.scanner.signals.library_changed.connect(partial(self.apply_library_changes, self.scanner))
+        self.scanner.signals.finished.connect(partial(self.finish_scan, self.scanner))
+        QThreadPool.globalInstance().start(self.scanner)
+
+    def apply_library_changes(self, scanner, removed, added):
+        # Only the affected rows change; the current and upcoming tracks are IDs, so they never point at the wrong song
+        if scanner is not self.scanner:
+            return
+        rows = sorted(row for row in (self.playlist.row_of(track_id(path)) for path in removed) if row != -1)
+        if rows:
+            gone = [self.playlist.ids[row] for row in rows]
+            self.playlist_model.remove_rows(rows)
+            self.drop_from_queue(gone)
+            self.current_changed.emit(self.current_row())
+        # A track the playlist already holds is never listed twice, whatever the scan thought was new
+        added = list({track_id(song.path): song for song in added if track_id(song.path) not in self.playlist}.values())
+        first = len(self.playlist)
+        self.playlist_model.append_songs(added)
+        self.shuffle.add(self.playlist.ids[first:])
+        if self.upcoming_id is not None and self.upcoming_id not in self.playlist:
+            self.prefetch_upcoming()
+
+    def rescan_library(self):
+        if self.current_id in self.playlist:
+            self.restore_path = self.playlist.paths[self.current_row()]
+        self.upcoming_id = None
+        self.scan_music_directory(full_rescan=True)
+
+    def play_song(self, index):
+        if 0 <= index < len(self.playlist):
+            self.play_track(self.playlist.ids[index])
+
+    def play_track(self, track):
+        row = self.playlist.row_of(track)
+        if row != -1:
+            self.media_player.setSource(self.track_url(row))
+            self.media_player.play()
+            self.show_track(track)
+
+    def play_row(self, index):
+        # A track picked by hand is a jump in the shuffle history, not a step through the permutation
+        if self.playback_mode == 'shuffle':
+            self.shuffle.jump(self.current_id)
+            self.save_shuffle()
+        self.play_song(index)
+
+    def show_advanced_track(self):
+        # The engine already switched to the preloaded track; only the UI and bookkeeping follow
+        track = self.upcoming_id
+        if track in self.playlist:
+            self.step_to(track)
+            self.show_track(track)
+
+    def current_row(self):
+        return self.playlist.row_of(self.current_id)
+
+    def current_path(self):
+        # A restored track keeps its identity even if the scan has not reached it yet
+        row = self.current_row()
+        return self.playlist.paths[row] if row != -1 else self.restore_path
+
+    def track_url(self, index):
+        return QUrl.fromLocalFile(os.path.abspath(self.playlist.paths[index]))
+
+    def show_track(self, track):
+        row = self.playlist.row_of(track)
+        self.current_id = track
+        self.restore_path = None
+        self.session.update(last_track_path=self.playlist.paths[row], last_position=0)
+        self.prefetch_upcoming()
+        self.current_changed.emit(row)
+
+    def resolve_next_id(self):
+        if not self.playlist: return None
+        queued = next((track for track in self.queue if track in self.playlist), None)
+        if queued is not None: return queued
+        if self.playback_mode == 'loop_one' and self.current_id in self.playlist: return self.current_id
+        elif self.playback_mode == 'shuffle': return self.shuffle.peek(self.playlist)
+        else: return self.playlist.ids[(self.current_row() + 1) % len(self.playlist)]
+
+    def step_to(self, track):
+        # Queued tracks leave the queue; the shuffle permutation only moves for tracks it picked itself
+        if track in self.queue:
+            self.queue.remove(track)
+            self.session.update(play_queue=self.queue.state())
+            if self.playback_mode == 'shuffle':
+                self.shuffle.jump(self.current_id)
+                self.save_shuffle()
+        elif self.playback_mode == 'shuffle':
+            self.shuffle.advance(self.current_id, self.playlist)
+            self.save_shuffle()
+
+    def prefetch_upcoming(self):
+        # The next track is picked ahead of time so its audio is opened before it is needed
+        self.upcoming_id = self.resolve_next_id()
+        row = self.playlist.row_of(self.upcoming_id)
+        if row != -1:
+            self.media_player.preload(self.track_url(row))
+
+    def next_song(self):
+        if not self.playlist: return
+        track = self.resolve_next_id()
+        self.step_to(track)
+        self.play_track(track)
+
+    def prev_song(self):
+        if not self.playlist: return
+        if self.playback_mode == 'shuffle':
+            track = self.shuffle.back(self.current_id, self.playlist)
+            if track is not None:
+                self.save_shuffle()
+                self.play_track(track)
+                return
+        self.play_song((self.current_row() - 1 + len(self.playlist)) % len(self.playlist))
+
+    def load_shuffle_order(self):
+        order = array('Q')
+        try:
+            with open(self.SHUFFLE_ORDER_PATH, 'rb') as f:
+                order.frombytes(f.read())
+        except (OSError, ValueError):
+            order = None
+        # Earlier sessions kept the permutation in config.json: track IDs under "shuffle_ids", rows under
+        # "shuffle_order". The first moves to its own file on the next save, the second starts a fresh cycle
+        legacy = self.session.state.pop("shuffle_ids", None)
+        self.session.state.pop("shuffle_order", None)
+        if order is None and isinstance(legacy, list):
+            self.shuffle.order_changed = True
+            return legacy
+        return order.tolist() if order else []
+
+    def save_shuffle(self):
+        self.session.update(**self.shuffle.state())
+        if self.shuffle.order_changed:
+            self.shuffle.order_changed = False
+            self.session.write_file(self.SHUFFLE_ORDER_PATH, array('Q', self.shuffle.order).tobytes())
+
+    ### Play Queue ###
+    def queue_row(self, index, play_next=False):
+        if not (0 <= index < len(self.playlist)):
+            return
+        track = self.playlist.ids[index]
+        if play_next:
+            self.queue.play_next(track)
+        else:
+            self.queue.enqueue(track)
+        self.queue_updated()
+
+    def drop_from_queue(self, tracks):
+        queued = [track for track in tracks if track in self.queue]
+        for track in queued:
+            self.queue.remove(track)
+        if queued:
+            self.queue_updated()
+
+    def clear_queue(self):
+        if self.queue:
+            self.queue = PlayQueue()
+            self.queue_updated()
+
+    def queue_updated(self):
+        self.session.update(play_queue=self.queue.state())
+        if self.current_id is not None:
+            self.prefetch_upcoming()
+
+    def toggle_play_pause(self):
+        if self.media_player.playbackState() == QMediaPlayer.PlaybackState.PlayingState:
+            self.media_player.pause()
+        else:
+            if self.current_id is None and self.playlist:
+                self.play_song(0)
+            else:
+                self.media_player.play()
+
+    def change_playback_mode(self):
+        modes = list(self.MODE_LABELS)
+        self.playback_mode = modes[(modes.index(self.playback_mode) + 1) % len(modes)]
+        self.tray_actions['loop'].setText(f"Mode: {self.MODE_LABELS[self.playback_mode]}")
+        self.session.update(playback_mode=self.playback_mode)
+        if self.current_id is not None:
+            self.prefetch_upcoming()
+        self.mode_changed.emit(self.playback_mode)
+
+    def set_volume(self, value):
+        self.volume = value / 100.0
+        self.media_player.setVolume(self.volume)
+        if self.is_muted and value > 0:
+            self.is_muted = False
+        self.session.update(volume=value)
+        self.volume_changed.emit()
+
+    def toggle_mute(self):
+        self.is_muted = not self.is_muted
+        self.media_player.setMuted(self.is_muted)
+        self.tray_actions['mute'].setText("Unmute" if self.is_muted else "Mute")
+        self.session.update(is_muted=self.is_muted)
+        self.volume_changed.emit()
+
+    def update_play_pause_action(self, state):
+        playing = state == QMediaPlayer.PlaybackState.PlayingState
+        self.tray_actions['play_pause'].setText("Pause" if playing else "Play")
+
+    def update_checkpoints(self, state):
+        if state == QMediaPlayer.PlaybackState.PlayingState:
+            self.checkpoint_timer.start()
+        else:
+            self.checkpoint_timer.stop()
+            self.save_position_checkpoint()
+
+    def save_position_checkpoint(self):
+        if self.current_id is not None:
+            self.session.update(last_position=self.media_player.position())
+
+    def handle_media_status(self, status):
+        if status == QMediaPlayer.MediaStatus.EndOfMedia:
+            self.next_song()
+
+class MusicPlayerWindow(QWidget):
+    PROGRESS_FPS = 10
+
+    def __init__(self, controller, parent=None):
+        super().__init__(parent)
+        self.controller = controller
+        self.media_player = controller.media_player
+        # The search index is built here rather than in the controller, so tray-only use never pays for it
+        self.playlist_filter = PlaylistFilterModel(controller.playlist_model, self)
         self.drag_pos = QPoint()
+        self.thumbnails = ThumbnailLoader(parent=self)
+        self.tracking_progress = False
+        self.pending_position = 0
+        self.displayed_second = -1
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setSingleShot(True)
+        self.progress_timer.setInterval(1000 // self.PROGRESS_FPS)
 
         ### Icons ###
+        tracer.begin("MusicPlayerWindow icons")
         self.icons = {
             'loop_all': QIcon(os.path.join('images', 'control-buttons', 'loop-all.png')),
             'loop_one': QIcon(os.path.join('images', 'control-buttons', 'loop-1.png')),
@@ -36,6 +1837,7 @@ class MusicPlayerWindow(QWidget):
             'play': QIcon(os.path.join('images', 'control-buttons', 'play.png')),
             'pause': QIcon(os.path.join('images', 'control-buttons', 'pause.png'))
         }
+        tracer.end()
 
         ### Window Flags and Attributes ###
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint | Qt.WindowType.WindowStaysOnTopHint)
@@ -44,12 +1846,12 @@ class MusicPlayerWindow(QWidget):
         self.setWindowIcon(QIcon(os.path.join('images', 'logo.png')))
         self.setMinimumSize(420, 220)
 
-        self._setup_ui()
-        self._apply_stylesheet()
+        with tracer.phase("MusicPlayerWindow ui"):
+            self._setup_ui()
+        with tracer.phase("MusicPlayerWindow stylesheet"):
+            self._apply_stylesheet()
+        self.sync_with_controller()
         self._connect_signals()
-        self.scan_music_directory()
-        self.load_config()
-        self.update_volume_icon()
 
     ### UI Setup ###
     def _setup_ui(self):
@@ -162,8 +1964,16 @@ class MusicPlayerWindow(QWidget):
         options_layout.addWidget(self.songs_list_button)
 
         # Playlist Widget
-        self.song_list_widget = QListWidget()
-        self.song_list_widget.setVisible(False)
+        self.search_box = QLineEdit()
+        self.search_box.setObjectName("SearchBox")
+        self.search_box.setPlaceholderText("Search title or artist")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.setVisible(False)
+        self.song_list_view = QListView()
+        self.song_list_view.setModel(self.playlist_filter)
+        self.song_list_view.setUniformItemSizes(True)
+        self.song_list_view.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.song_list_view.setVisible(False)
 
         content_layout.addLayout(info_layout)
         content_layout.addLayout(progress_layout)
@@ -171,7 +1981,8 @@ class MusicPlayerWindow(QWidget):
         content_layout.addLayout(options_layout)
         
         self.main_layout.addLayout(content_layout)
-        self.main_layout.addWidget(self.song_list_widget)
+        self.main_layout.addWidget(self.search_box)
+        self.main_layout.addWidget(self.song_list_view)
 
     def setCentralWidget(self, widget):
         layout = QVBoxLayout(self)
@@ -259,31 +2070,54 @@ class MusicPlayerWindow(QWidget):
             QSlider::handle:horizontal {
                 background: #61afef; border: 1px solid #61afef; width: 14px; height: 14px; margin: -4px 0; border-radius: 7px;
             }
-            QListWidget {
+            QListView {
                 background-color: #21252b; border: 1px solid #353b45; font-size: 14px; padding: 5px;
             }
-            QListWidget::item { padding: 8px; }
-            QListWidget::item:selected { background-color: #61afef; color: #282c34; }
+            #SearchBox {
+                background-color: #21252b; color: #abb2bf; border: 1px solid #353b45; border-radius: 6px; font-size: 14px; padding: 6px;
+            }
+            QListView::item { padding: 8px; }
+            QListView::item:selected { background-color: #61afef; color: #282c34; }
             QToolTip { background-color: #21252b; color: #abb2bf; border: 1px solid #353b45; padding: 4px; border-radius: 3px; }
         """)
 
     def _connect_signals(self):
         self.minimize_button.clicked.connect(self.showMinimized)
         self.close_button.clicked.connect(self.hide)
-        self.play_pause_button.clicked.connect(self.toggle_play_pause)
-        self.next_button.clicked.connect(self.next_song)
-        self.prev_button.clicked.connect(self.prev_song)
-        self.loop_button.clicked.connect(self.change_playback_mode)
+        self.play_pause_button.clicked.connect(self.controller.toggle_play_pause)
+        self.next_button.clicked.connect(self.controller.next_song)
+        self.prev_button.clicked.connect(self.controller.prev_song)
+        self.loop_button.clicked.connect(self.controller.change_playback_mode)
         self.songs_list_button.clicked.connect(self.toggle_song_list)
-        self.song_list_widget.itemDoubleClicked.connect(self.play_from_list)
+        self.song_list_view.doubleClicked.connect(self.play_from_list)
+        self.song_list_view.customContextMenuRequested.connect(self.show_song_menu)
+        self.search_box.textChanged.connect(self.filter_playlist)
+        self.search_box.returnPressed.connect(self.play_first_match)
+        self.playlist_filter.indexing_finished.connect(self.select_current_row)
+        self.controller.current_changed.connect(self.show_track)
+        self.controller.mode_changed.connect(self.update_mode)
+        self.controller.volume_changed.connect(self.update_volume_icon)
+        self.controller.scan_finished.connect(self.show_library_status)
         self.media_player.playbackStateChanged.connect(self.update_play_pause_icon)
-        self.media_player.positionChanged.connect(self.update_slider_position)
+        self.progress_timer.timeout.connect(self.refresh_progress)
         self.media_player.durationChanged.connect(self.set_slider_range)
-        self.media_player.mediaStatusChanged.connect(self.handle_media_status)
         self.progress_slider.sliderMoved.connect(self.media_player.setPosition)
-        self.volume_slider.valueChanged.connect(self.set_volume)
-        self.volume_button.clicked.connect(self.toggle_mute)
-        
+        self.volume_slider.valueChanged.connect(self.controller.set_volume)
+        self.volume_button.clicked.connect(self.controller.toggle_mute)
+        self.thumbnails.thumbnail_ready.connect(self.show_thumbnail)
+
+    def sync_with_controller(self):
+        # The window may be opened long after playback started, so it starts from the controller's current state
+        self.volume_slider.setValue(round(self.controller.volume * 100))
+        self.update_volume_icon()
+        self.update_mode(self.controller.playback_mode)
+        self.update_play_pause_icon(self.media_player.playbackState())
+        self.set_slider_range(self.media_player.duration())
+        if self.controller.current_row() != -1:
+            self.show_track(self.controller.current_row())
+        else:
+            self.show_library_status()
+
     def _format_time(self, ms):
         seconds = int((ms / 1000) % 60)
         minutes = int((ms / (1000 * 60)) % 60)
@@ -297,181 +2131,480 @@ class MusicPlayerWindow(QWidget):
         if event.buttons() == Qt.MouseButton.LeftButton:
             self.move(event.globalPosition().toPoint() - self.drag_pos)
 
-    ### Music Directory Scanner ###
-    def scan_music_directory(self):
-        music_dir = Path("./music")
-        self.playlist = []
-        self.song_list_widget.clear()
-        if not music_dir.exists():
+    def show_track(self, index):
+        playlist = self.controller.playlist
+        if not (0 <= index < len(playlist)):
+            self.select_row(-1)
             return
+        song = playlist[index]
+        self.title_label.setText(song.title)
+        self.artist_label.setText(song.artist)
+        pixmap = self.thumbnails.get(song.thumbnail) if song.thumbnail else None
+        if pixmap is not None:
+            self.show_thumbnail(song.thumbnail, pixmap)
+        elif song.thumbnail:
+            self.thumbnail_label.clear()
+            self.thumbnails.request(song.thumbnail)
+        else:
+            self.thumbnail_label.setPixmap(QPixmap())
+            self.thumbnail_label.setText("No Art")
+        self.select_row(index)
+        self.prefetch_thumbnail()
+
+    def prefetch_thumbnail(self):
+        # Cover art for the upcoming track is decoded before it is needed
+        upcoming = self.controller.playlist.row_of(self.controller.upcoming_id)
+        if upcoming != -1 and self.controller.playlist.thumbnails[upcoming]:
+            self.thumbnails.request(self.controller.playlist.thumbnails[upcoming])
+
+    def show_thumbnail(self, path, pixmap):
+        current = self.controller.current_row()
+        if current == -1 or self.controller.playlist.thumbnails[current] != path:
+            return
+        if pixmap.isNull():
+            self.thumbnail_label.setText("No Art")
+        else:
+            self.thumbnail_label.setPixmap(pixmap)
 
-        for song_dir in music_dir.iterdir():
-            if song_dir.is_dir():
-                mp3_files = list(song_dir.glob('*.mp3'))
-                if not mp3_files:
-                    continue
-                
-                mp3_path = mp3_files[0]
-                title, artist = "Unknown Title", "Unknown Artist"
-                filename_stem = mp3_path.stem
-                if '_' in filename_stem:
-                    parts = filename_stem.split('_', 1)
-                    title = parts[0].replace('-', ' ')
-                    if len(parts) > 1:
-                        artist = parts[1].replace('-', ' ')
-                else:
-                    title = filename_stem.replace('-', ' ')
-
-                thumbnail_path = None
-                for ext in ['.jpg', '.png', '.jfif']:
-                    if (song_dir / f"thumbnail{ext}").exists():
-                        thumbnail_path = song_dir / f"thumbnail{ext}"
-                        break
-
-                song_data = {"title": title, "artist": artist, "path": mp3_path, "thumbnail": thumbnail_path}
-                self.playlist.append(song_data)
-                item = QListWidgetItem(f"{song_data['title']} - {song_data['artist']}")
-                self.song_list_widget.addItem(item)
-        
-        if not self.playlist:
+    def show_library_status(self):
+        if not self.controller.playlist and self.controller.scanner is None:
             self.title_label.setText("No music found")
             self.artist_label.setText("Check ./music folder structure")
 
-    def set_initial_position(self, position):
-        self.media_player.setPosition(position)
-        try:
-            self.media_player.durationChanged.disconnect()
-        except RuntimeError:
-            pass 
-        self.media_player.durationChanged.connect(self.set_slider_range)
-
-    def play_song(self, index):
-        if 0 <= index < len(self.playlist):
-            self.current_index = index
-            song = self.playlist[index]
-            self.media_player.setSource(QUrl.fromLocalFile(str(song['path'].absolute())))
-            self.media_player.play()
-            self.title_label.setText(song['title'])
-            self.artist_label.setText(song['artist'])
-            if song['thumbnail']:
-                self.thumbnail_label.setPixmap(QPixmap(str(song['thumbnail'])).scaled(100, 100, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
-            else:
-                self.thumbnail_label.setPixmap(QPixmap())
-                self.thumbnail_label.setText("No Art")
-            self.song_list_widget.setCurrentRow(index)
-
-    def next_song(self):
-        if not self.playlist: return
-        if self.playback_mode == 'loop_one': self.play_song(self.current_index)
-        elif self.playback_mode == 'shuffle': self.play_song(randint(0, len(self.playlist) - 1))
-        else: self.play_song((self.current_index + 1) % len(self.playlist))
-
-    def prev_song(self):
-        if not self.playlist: return
-        self.play_song((self.current_index - 1 + len(self.playlist)) % len(self.playlist))
-
-    def toggle_play_pause(self):
-        if self.media_player.playbackState() == QMediaPlayer.PlaybackState.PlayingState:
-            self.media_player.pause()
-        else:
-            if self.current_index == -1 and self.playlist:
-                self.play_song(0)
-            else:
-                self.media_player.play()
-
-    def change_playback_mode(self):
-        if self.playback_mode == 'loop_all': 
-            self.playback_mode = 'loop_one'
-            self.loop_button.setIcon(self.icons['loop_one'])
-            self.loop_button.setToolTip("Loop One")
-            self.tray_actions['loop'].setText("Mode: Loop One")
-        elif self.playback_mode == 'loop_one': 
-            self.playback_mode = 'shuffle'
-            self.loop_button.setIcon(self.icons['shuffle'])
-            self.loop_button.setToolTip("Shuffle")
-            self.tray_actions['loop'].setText("Mode: Shuffle")
-        else: 
-            self.playback_mode = 'loop_all'
-            self.loop_button.setIcon(self.icons['loop_all'])
-            self.loop_button.setToolTip("Loop All")
-            self.tray_actions['loop'].setText("Mode: Loop All")
-
-    def set_volume(self, value):
-        self.volume = value / 100.0
-        self.media_player.audioOutput().setVolume(self.volume)
-        if self.is_muted and value > 0:
-            self.is_muted = False
-        self.update_volume_icon()
-
-    def toggle_mute(self):
-        self.is_muted = not self.is_muted
-        self.media_player.audioOutput().setMuted(self.is_muted)
-        self.update_volume_icon()
-        self.tray_actions['mute'].setText("Unmute" if self.is_muted else "Mute")
+    def update_mode(self, mode):
+        self.loop_button.setIcon(self.icons[mode])
+        self.loop_button.setToolTip(self.controller.MODE_LABELS[mode])
+        self.prefetch_thumbnail()
 
     def update_volume_icon(self):
-        if self.is_muted or self.volume == 0:
+        if self.controller.is_muted or self.controller.volume == 0:
             self.volume_button.setIcon(self.icons['volume_muted'])
-        elif self.volume < 0.5:
+        elif self.controller.volume < 0.5:
             self.volume_button.setIcon(self.icons['volume_half'])
         else:
             self.volume_button.setIcon(self.icons['volume_full'])
 
     def toggle_song_list(self):
-        self.song_list_widget.setVisible(not self.song_list_widget.isVisible())
+        visible = not self.song_list_view.isVisible()
+        self.song_list_view.setVisible(visible)
+        self.search_box.setVisible(visible)
         self.adjustSize()
 
-    def play_from_list(self, item):
-        self.play_song(self.song_list_widget.row(item))
+    def filter_playlist(self, text):
+        self.playlist_filter.set_query(text)
+        self.select_current_row()
+
+    def play_first_match(self):
+        if self.playlist_filter.rowCount() > 0:
+            self.play_from_list(self.playlist_filter.index(0))
+
+    def play_from_list(self, index):
+        self.controller.play_row(self.playlist_filter.mapToSource(index).row())
+
+    def show_song_menu(self, pos):
+        index = self.song_list_view.indexAt(pos)
+        menu = QMenu(self)
+        if index.isValid():
+            row = self.playlist_filter.mapToSource(index).row()
+            menu.addAction("Play Next", partial(self.controller.queue_row, row, play_next=True))
+            menu.addAction("Add to Queue", partial(self.controller.queue_row, row))
+        clear_action = menu.addAction(f"Clear Queue ({len(self.controller.queue)})", self.controller.clear_queue)
+        clear_action.setEnabled(bool(self.controller.queue))
+        menu.exec(self.song_list_view.viewport().mapToGlobal(pos))
+
+    def select_current_row(self):
+        self.select_row(self.controller.current_row())
+
+    def select_row(self, row):
+        self.song_list_view.setCurrentIndex(self.playlist_filter.mapFromSource(self.controller.playlist_model.index(row)))
 
     def update_play_pause_icon(self, state):
         if state == QMediaPlayer.PlaybackState.PlayingState:
             self.play_pause_button.setIcon(self.icons['pause'])
             self.play_pause_button.setToolTip("Pause")
-            self.tray_actions['play_pause'].setText("Pause")
         else:
             self.play_pause_button.setIcon(self.icons['play'])
             self.play_pause_button.setToolTip("Play")
-            self.tray_actions['play_pause'].setText("Play")
+
+    ### Progress Display ###
+    # Position updates are only followed while the window is on screen, and at most PROGRESS_FPS times a second
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.set_progress_tracking(not self.isMinimized())
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.set_progress_tracking(False)
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.WindowStateChange:
+            self.set_progress_tracking(self.isVisible() and not self.isMinimized())
+
+    def set_progress_tracking(self, enabled):
+        if enabled == self.tracking_progress:
+            return
+        self.tracking_progress = enabled
+        if enabled:
+            self.media_player.positionChanged.connect(self.update_slider_position)
+            self.pending_position = self.media_player.position()
+            self.refresh_progress()
+        else:
+            self.media_player.positionChanged.disconnect(self.update_slider_position)
+            self.progress_timer.stop()
 
     def update_slider_position(self, position):
-        self.progress_slider.setValue(position)
-        self.current_time_label.setText(self._format_time(position))
+        self.pending_position = position
+        if not self.progress_timer.isActive():
+            self.progress_timer.start()
+
+    def refresh_progress(self):
+        if not self.progress_slider.isSliderDown():
+            self.progress_slider.setValue(self.pending_position)
+        second = self.pending_position // 1000
+        if second != self.displayed_second:
+            self.displayed_second = second
+            self.current_time_label.setText(self._format_time(self.pending_position))
 
     def set_slider_range(self, duration):
         self.progress_slider.setRange(0, duration)
         self.total_time_label.setText(self._format_time(duration))
 
-    def handle_media_status(self, status):
-        if status == QMediaPlayer.MediaStatus.EndOfMedia:
-            self.next_song()
-
     def closeEvent(self, event):
         self.hide()
         event.ignore()
 
+### --- Sprite Atlas --- ###
+# Frames per animation and facing direction (-1 = left, 1 = right). Animated GIFs expand into all of their frames.
+# Right-facing files are optional: a missing one is mirrored from the left frame at the same position.
+FOX_ANIMATIONS = {
+    'idle': {-1: ['fox-1.png', 'fox-2.png'], 1: ['fox-1.png', 'fox-2.png']},
+    'walk': {-1: ['fox-walking-left-1.png', 'fox-walking-left-2.png'], 1: ['fox-walking-right-1.png', 'fox-walking-right-2.png']},
+    'posture_idle': {-1: ['fox-idle-left.png'], 1: ['fox-idle-right.png']},
+    'shock': {-1: ['fox-shock-left.png'], 1: ['fox-shock-right.png']},
+    'post_trauma': {-1: ['fox-post-trauma-left-1.png', 'fox-post-trauma-left-2.png'], 1: ['fox-post-trauma-right-1.png', 'fox-post-trauma-right-2.png']},
+    'sleep': {-1: ['fox-sleeping.gif'], 1: ['fox-sleeping.gif']},
+}
+
+class SpriteAtlas:
+    # Bumped whenever the way the atlas is packed changes, so older atlases are rebuilt
+    FORMAT_VERSION = 1
+
+    def __init__(self, directory=os.path.join('images', 'fox'), animations=FOX_ANIMATIONS, name='fox-atlas'):
+        self.directory = directory
+        self.animations = animations
+        self.image_path = os.path.join(directory, f"{name}.png")
+        self.manifest_path = os.path.join(directory, f"{name}.json")
+        self.delays = {}
+
+    def load(self):
+        # One image read at startup; the atlas is rebuilt only when a source frame or the animation table changes
+        manifest = self._read_manifest()
+        if manifest is None or manifest.get('layout') != self._layout() or manifest['sources'] != self._source_mtimes():
+            manifest, atlas = self._build()
+        else:
+            atlas = QPixmap(self.image_path)
+            if atlas.isNull():
+                manifest, atlas = self._build()
+
+        self.delays = manifest['delays']
+        width, height = manifest['frame_size']
+        cells = [atlas.copy(QRect(i * width, 0, width, height)) for i in range(manifest['cell_count'])]
+        return {name: {int(direction): [cells[i] for i in indices] for direction, indices in directions.items()}
+                for name, directions in manifest['animations'].items()}
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _layout(self):
+        table = json.dumps(self.animations, sort_keys=True)
+        return hashlib.sha1(f"{self.FORMAT_VERSION}|{table}".encode()).hexdigest()
+
+    def _source_mtimes(self):
+        sources = {}
+        for directions in self.animations.values():
+            for files in directions.values():
+                for file_name in files:
+                    try:
+                        sources[file_name] = os.stat(os.path.join(self.directory, file_name)).st_mtime_ns
+                    except OSError:
+                        pass
+        return sources
+
+    def _read_frames(self, file_name):
+        # Animated images are decoded once here; their per-frame delays go into the manifest
+        reader = QImageReader(os.path.join(self.directory, file_name))
+        frames = []
+        while True:
+            image = reader.read()
+            if image.isNull():
+                break
+            frames.append((image, reader.nextImageDelay()))
+            if not reader.supportsAnimation():
+                break
+        return frames
+
+    def _build(self):
+        cell_keys, images, animations, delays = {}, [], {}, {}
+        for name, directions in self.animations.items():
+            animations[name] = {}
+            for direction, files in directions.items():
+                indices, frame_delays = [], []
+                for position, file_name in enumerate(files):
+                    key = file_name
+                    if not os.path.exists(os.path.join(self.directory, file_name)):
+                        key = ('mirror', directions[-direction][position])
+                    if key not in cell_keys:
+                        if isinstance(key, tuple):
+                            frames = [(image.flipped(Qt.Orientation.Horizontal), delay) for image, delay in self._read_frames(key[1])]
+                        else:
+                            frames = self._read_frames(key)
+                        cell_keys[key] = [(len(images) + i, delay) for i, (_, delay) in enumerate(frames)]
+                        images.extend(image for image, _ in frames)
+                    indices.extend(cell for cell, _ in cell_keys[key])
+                    frame_delays.extend(delay for _, delay in cell_keys[key])
+                animations[name][str(direction)] = indices
+                if len(frame_delays) > 1 and all(frame_delays):
+                    delays[name] = frame_delays
+
+        width = max(image.width() for image in images)
+        height = max(image.height() for image in images)
+        atlas_image = QImage(width * len(images), height, QImage.Format.Format_ARGB32)
+        atlas_image.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(atlas_image)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        for i, image in enumerate(images):
+            painter.drawImage(i * width, 0, image)
+        painter.end()
+
+        manifest = {'frame_size': [width, height], 'cell_count': len(images), 'layout': self._layout(),
+                    'sources': self._source_mtimes(), 'animations': animations, 'delays': delays}
+        try:
+            if atlas_image.save(self.image_path, "PNG"):
+                with open(self.manifest_path, 'w') as f:
+                    json.dump(manifest, f)
+        except OSError as e:
+            print(f"Error saving sprite atlas: {e}")
+        return manifest, QPixmap.fromImage(atlas_image)
+
+### --- Behavior Scheduler --- ###
+def on_battery_power():
+    if sys.platform.startswith('linux'):
+        supplies = Path('/sys/class/power_supply')
+        try:
+            mains = [s for s in supplies.iterdir() if (s / 'type').read_text().strip() == 'Mains']
+            return bool(mains) and not any((s / 'online').read_text().strip() == '1' for s in mains)
+        except OSError:
+            return False
+    if sys.platform == 'win32':
+        import ctypes
+
+        class SystemPowerStatus(ctypes.Structure):
+            _fields_ = [('ACLineStatus', ctypes.c_byte), ('BatteryFlag', ctypes.c_byte), ('BatteryLifePercent', ctypes.c_byte),
+                        ('SystemStatusFlag', ctypes.c_byte), ('BatteryLifeTime', ctypes.c_ulong), ('BatteryFullLifeTime', ctypes.c_ulong)]
+
+        status = SystemPowerStatus()
+        return bool(ctypes.windll.kernel32.GetSystemPowerStatus(ctypes.byref(status))) and status.ACLineStatus == 0
+    return False
+
+class ScheduledCall:
+    __slots__ = ("deadline", "seq", "callback", "interval", "cancelled")
+
+    def __init__(self, deadline, seq, callback, interval=None):
+        self.deadline = deadline
+        self.seq = seq
+        self.callback = callback
+        self.interval = interval
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+class BehaviorScheduler(QObject):
+    # One timer armed for the earliest deadline; everything due within the slack runs in the same wakeup
+    SLACK_MS = 10
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.clock = QElapsedTimer()
+        self.clock.start()
+        self.queue = []
+        self.seq = count()
+        self.armed_deadline = None
+        self.suspended_at = None
+        self.wakeup_times = deque()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._dispatch)
+
+    def call_later(self, delay_ms, callback, grid_ms=None):
+        deadline = self.clock.elapsed() + delay_ms
+        if grid_ms:
+            # Randomized delays lose nothing by landing on the grid of the repeating calls, and then share their wakeups
+            deadline = self._next_tick(grid_ms, after=deadline - 1)
+        call = ScheduledCall(deadline, next(self.seq), callback)
+        self._push(call)
+        return call
+
+    def call_every(self, interval_ms, callback):
+        # Repeating calls are aligned to a shared grid so equal intervals always fire together
+        call = ScheduledCall(self._next_tick(interval_ms), next(self.seq), callback, interval_ms)
+        self._push(call)
+        return call
+
+    @property
+    def is_suspended(self):
+        return self.suspended_at is not None
+
+    def suspend(self):
+        if self.suspended_at is None:
+            self.suspended_at = self.clock.elapsed()
+            self.armed_deadline = None
+            self.timer.stop()
+
+    def resume(self):
+        # Pending one-shot calls are pushed back by the time spent suspended, so states resume where they left off
+        if self.suspended_at is None:
+            return
+        suspended_for = self.clock.elapsed() - self.suspended_at
+        self.suspended_at = None
+        for call in self.queue:
+            call.deadline = self._next_tick(call.interval) if call.interval else call.deadline + suspended_for
+        heapq.heapify(self.queue)
+        self._rearm()
+
+    def wakeups_per_minute(self):
+        horizon = self.clock.elapsed() - 60000
+        while self.wakeup_times and self.wakeup_times[0] < horizon:
+            self.wakeup_times.popleft()
+        return len(self.wakeup_times)
+
+    def _next_tick(self, interval_ms, after=None):
+        after = self.clock.elapsed() if after is None else after
+        return (after // interval_ms + 1) * interval_ms
+
+    def _push(self, call):
+        heapq.heappush(self.queue, call)
+        if self.suspended_at is None and (self.armed_deadline is None or call.deadline < self.armed_deadline):
+            self._rearm()
+
+    def _rearm(self):
+        while self.queue and self.queue[0].cancelled:
+            heapq.heappop(self.queue)
+        if not self.queue:
+            self.armed_deadline = None
+            self.timer.stop()
+            return
+        self.armed_deadline = self.queue[0].deadline
+        self.timer.start(max(0, self.armed_deadline - self.clock.elapsed()))
+
+    def _dispatch(self):
+        # Due calls are taken off the queue and the timer is re-armed before any of them runs, so a callback
+        # that blocks in a nested event loop (the modal rating dialog) does not stall every other behavior
+        now = self.clock.elapsed()
+        self.wakeup_times.append(now)
+        self.wakeups_per_minute()
+        horizon = now + self.SLACK_MS
+        due = []
+        while self.queue and self.queue[0].deadline <= horizon:
+            call = heapq.heappop(self.queue)
+            if call.cancelled:
+                continue
+            due.append(call)
+            if call.interval:
+                # The next tick is counted from the horizon, not from now; otherwise a call due within
+                # the slack would be rescheduled into the same wakeup and spin forever
+                call.deadline = self._next_tick(call.interval, after=horizon)
+                heapq.heappush(self.queue, call)
+        self._rearm()
+        for position, call in enumerate(due):
+            if self.suspended_at is not None:
+                # Suspended by an earlier callback: one-shot calls go back and wait for resume like the rest
+                for pending in due[position:]:
+                    if not pending.interval:
+                        heapq.heappush(self.queue, pending)
+                break
+            if not call.cancelled:
+                call.callback()
+
 ### --- Onboarding Speech Bubbles --- ###
 class SpeechBubble(QWidget):
-    def __init__(self, text, parent, word_wrap=True):
-        super().__init__(parent)
+    # One window reused for every message. Each message is drawn once into a cached pixmap; showing it again
+    # only resizes, moves and repaints the window, with no widgets, layouts or stylesheets built
+    MAX_TEXT_WIDTH = 248
+    PADDING = 11
+    RADIUS = 10
+    CACHE_SIZE = 32
+
+    def __init__(self):
+        super().__init__()
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint | Qt.WindowType.Tool | Qt.WindowType.WindowStaysOnTopHint)
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground, True)
-        self.layout = QVBoxLayout()
-        self.label = QLabel(text)
-        self.label.setStyleSheet("background-color: white; color: black; border: 1px solid black; border-radius: 10px; padding: 10px;")
-        if word_wrap:
-            self.label.setWordWrap(True)
-            self.label.setMaximumWidth(270)
-        self.layout.addWidget(self.label)
-        self.setLayout(self.layout)
-
-    def show_smartly_positioned(self):
-        parent_geometry = self.parent().geometry()
-        x = parent_geometry.center().x() - self.width() / 2
-        y_above = parent_geometry.top() - self.height() - 5
-        self.move(int(x), int(y_above if y_above > 0 else parent_geometry.bottom() + 5))
+        self.anchor = None
+        self.pixmap = QPixmap()
+        self.rendered = OrderedDict()
+
+    def show_message(self, text, anchor, word_wrap=True):
+        self.anchor = anchor
+        self.pixmap = self.render_message(text, word_wrap)
+        size = self.pixmap.deviceIndependentSize().toSize()
+        if size != self.size():
+            self.resize(size)
+        self.follow()
+        self.update()
         self.show()
 
+    def dismiss(self, anchor):
+        if self.anchor is anchor:
+            self.anchor = None
+            self.hide()
+
+    def follow(self):
+        # Centered above the fox, or below it when there is no room at the top of the screen
+        geometry = self.anchor.geometry()
+        x = geometry.center().x() - self.width() // 2
+        y_above = geometry.top() - self.height() - 5
+        self.move(x, y_above if y_above > 0 else geometry.bottom() + 5)
+
+    def render_message(self, text, word_wrap):
+        ratio = self.devicePixelRatioF()
+        key = (text, word_wrap, ratio)
+        pixmap = self.rendered.get(key)
+        if pixmap is not None:
+            self.rendered.move_to_end(key)
+            return pixmap
+
+        flags = Qt.AlignmentFlag.AlignLeft | Qt.TextFlag.TextWordWrap if word_wrap else Qt.AlignmentFlag.AlignLeft
+        text_rect = QFontMetrics(self.font()).boundingRect(QRect(0, 0, self.MAX_TEXT_WIDTH if word_wrap else 10000, 10000), flags, text)
+        width, height = text_rect.width() + 2 * self.PADDING, text_rect.height() + 2 * self.PADDING
+        pixmap = QPixmap(round(width * ratio), round(height * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(QColor("black"))
+        painter.setBrush(QColor("white"))
+        painter.drawRoundedRect(QRectF(0.5, 0.5, width - 1, height - 1), self.RADIUS, self.RADIUS)
+        painter.setFont(self.font())
+        painter.drawText(QRect(self.PADDING, self.PADDING, text_rect.width(), text_rect.height()), flags, text)
+        painter.end()
+
+        self.rendered[key] = pixmap
+        if len(self.rendered) > self.CACHE_SIZE:
+            self.rendered.popitem(last=False)
+        return pixmap
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.pixmap)
+
 ### --- Feeling Survey Window --- ###
 class RatingDialog(QDialog):
     def __init__(self, question, parent=None):
@@ -498,24 +2631,36 @@ class RatingDialog(QDialog):
 
 ### --- Desktop Pet --- ###
 class DesktopPet(QWidget):
-    def __init__(self):
+    BATTERY_SLOWDOWN = 2
+    # Frame intervals are multiples of this, so state changes of every fox line up with the animation ticks
+    TICK_MS = 150
+    # state: (animation or pose, frame interval ms, duration range ms, next state)
+    STATES = {
+        'intro':               ('idle', 300, None, None),
+        'walking':             ('walk', 150, None, None),
+        'wagging':             ('idle', 300, (1500, 3000), 'walking'),
+        'pausing':             ('posture_idle', None, (1500, 3000), 'walking'),
+        'turning':             ('posture_idle', None, (300, 500), 'turned'),
+        'turned':              ('posture_idle', None, (300, 500), 'walking'),
+        'wondering':           ('posture_idle', None, (600, 1000), 'wondering'),
+        'idling_before_sleep': ('posture_idle', None, (700, 1200), 'sleeping'),
+        'sleeping':            ('sleep', None, (10000, 20000), 'waking_up'),
+        'waking_up':           ('posture_idle', None, (700, 1200), 'walking'),
+        'shock':               ('shock', None, None, None),
+        'post_trauma':         ('post_trauma', 300, (2000, 3000), 'recovering'),
+        'recovering':          ('posture_idle', None, (500, 1000), 'walking'),
+    }
+
+    def __init__(self, host, index=0):
         super().__init__()
+        self.host = host
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint | Qt.WindowType.WindowStaysOnTopHint | Qt.WindowType.Tool)
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground, True)
 
         ### Animations Assets ###
-        self.assets = {
-            'idle': [QPixmap(os.path.join('images', 'fox', 'fox-1.png')), QPixmap(os.path.join('images', 'fox', 'fox-2.png'))],
-            'walk_left': [QPixmap(os.path.join('images', 'fox', 'fox-walking-left-1.png')), QPixmap(os.path.join('images', 'fox', 'fox-walking-left-2.png'))],
-            'walk_right': [QPixmap(os.path.join('images', 'fox', 'fox-walking-right-1.png')), QPixmap(os.path.join('images', 'fox', 'fox-walking-right-2.png'))],
-            'posture_idle_left': QPixmap(os.path.join('images', 'fox', 'fox-idle-left.png')),
-            'posture_idle_right': QPixmap(os.path.join('images', 'fox', 'fox-idle-right.png')),
-            'shock_left': QPixmap(os.path.join('images', 'fox', 'fox-shock-left.png')),
-            'shock_right': QPixmap(os.path.join('images', 'fox', 'fox-shock-right.png')),
-            'post_trauma_left': [QPixmap(os.path.join('images', 'fox', 'fox-post-trauma-left-1.png')), QPixmap(os.path.join('images', 'fox', 'fox-post-trauma-left-2.png'))],
-            'post_trauma_right': [QPixmap(os.path.join('images', 'fox', 'fox-post-trauma-right-1.png')), QPixmap(os.path.join('images', 'fox', 'fox-post-trauma-right-2.png'))],
-            'sleep': QMovie(os.path.join('images', 'fox', 'fox-sleeping.gif')),
-        }
+        # Read-only frames shared by every fox; QPixmap is implicitly shared, so no pixels are copied
+        self.frames = host.frames
+        self.frame_delays = host.frame_delays
 
         ### Onboarding Questions and Responses ###
         self.questions = ["How's your day going?",
@@ -528,48 +2673,34 @@ class DesktopPet(QWidget):
             4: ["That's great to hear! Let's keep it up.", "Awesome! You're doing great.",  "Let's celebrate your day!"],
             5: ["Wow, how amazing! I'm happy for you.", "That's fantastic!", "Let's celebrate!", "I'm so glad to hear that! Keep shining!"]
         }
-        self.bubble = None
 
         ### Layout ###
         self.layout = QVBoxLayout()
         self.pet_label = QLabel(self)
-        self.pet_label.setPixmap(self.assets['idle'][0])
+        self.pet_label.setPixmap(self.frames['idle'][1][0])
         self.layout.addWidget(self.pet_label)
         self.setLayout(self.layout)
-        self.resize(self.assets['idle'][0].size())
+        self.resize(self.frames['idle'][1][0].size())
 
         ### Screen Geometry & Initial Position ###
-        self.screen_geometry = QApplication.primaryScreen().geometry()
-        self.available_geometry = QApplication.primaryScreen().availableGeometry()
-        initial_x = self.available_geometry.width() - self.width() - 80
-        self.move(initial_x, 0)
-        self.update_position()
-
-        ### Timers ###
-        # Display Check Timer
-        self.display_check_timer = QTimer(self)
-        self.display_check_timer.timeout.connect(self.check_display_changes)
-
-        # Animation Timer
-        self.animation_timer = QTimer(self)
-        self.animation_timer.timeout.connect(self.update_animation_frame)
-
-        # State Change Timer
-        self.state_change_timer = QTimer(self)
-        self.state_change_timer.setSingleShot(True)
-        self.state_change_timer.timeout.connect(self.switch_state)
-
-        # Walk Logic Timer
-        self.walk_logic_timer = QTimer(self)
-        self.walk_logic_timer.timeout.connect(self.update_walk_logic)
-
-        # Post Trauma Timer
-        self.post_trauma_timer = QTimer(self)
-        self.post_trauma_timer.setSingleShot(True)
-        self.post_trauma_timer.timeout.connect(self.resume_from_trauma)
+        self.screen_spans = []
+        self.current_span = None
+        primary_area = QApplication.primaryScreen().availableGeometry()
+        # Extra foxes start side by side to the left of the first one
+        x = primary_area.right() + 1 - self.width() - 80 - index * self.width()
+        self.move(max(x, primary_area.left()), primary_area.top())
+        self.watch_screens()
+
+        ### Scheduler ###
+        # Every timed behavior of every fox goes through the host's scheduler; calls tied to a state are cancelled on transition
+        self.scheduler = host.scheduler
+        self.state_calls = []
+        self.animation_call = None
+        self.sleep_call = None
+        self.sleep_due = False
 
         ### State Initialization ###
-        self.state = 'intro'
+        self.state = None
         self.frame_index = 0
         self.speed = 2
         self.direction = choice([-1, 1])
@@ -579,123 +2710,61 @@ class DesktopPet(QWidget):
         self.is_dragging = False
         self.drag_start_pos = None
 
-        ### Music Player Initialization ###
-        self._initialize_music_player()
-        self.setup_tray_icon()
-        self.start_intro_sequence()
-        self.show()
-        
-        app = QApplication.instance()
-        app.aboutToQuit.connect(self.save_config)
-
-    def _initialize_music_player(self):
-        self.tray_actions = {
-            'play_pause': QAction("Play"),
-            'prev': QAction("Previous"),
-            'next': QAction("Next"),
-            'loop': QAction("Mode: Loop All"),
-            'mute': QAction("Mute"),
-            'open': QAction("Open Player")
-        }
-        self.media_player = QMediaPlayer()
-        self._audio_output = QAudioOutput()
-        self.media_player.setAudioOutput(self._audio_output)
-        self.music_player_window = MusicPlayerWindow(self.media_player, self.tray_actions)
-
-    def save_config(self):
-        if not self.music_player_window or not self.media_player:
-            return
-        
-        config_data = {
-            "last_track_index": self.music_player_window.current_index,
-            "last_position": self.media_player.position(),
-            "volume": self.music_player_window.volume_slider.value(),
-            "is_muted": self.media_player.audioOutput().isMuted(),
-            "playback_mode": self.music_player_window.playback_mode
-        }
-        
-        try:
-            with open("config.json", 'w') as f:
-                json.dump(config_data, f, indent=4)
-        except IOError as e:
-            print(f"Error saving config: {e}")
-
-    def setup_tray_icon(self):
-        self.tray_icon = QSystemTrayIcon(self)
-        self.tray_icon.setIcon(QIcon(os.path.join('images', 'logo.png')))
-        self.tray_icon.setToolTip("Your Pet")
-        
-        tray_menu = QMenu()
-        
-        self.music_menu = QMenu("Music")
-        
-        self.tray_actions['play_pause'].triggered.connect(self.music_player_window.toggle_play_pause)
-        self.tray_actions['prev'].triggered.connect(self.music_player_window.prev_song)
-        self.tray_actions['next'].triggered.connect(self.music_player_window.next_song)
-        self.tray_actions['loop'].triggered.connect(self.music_player_window.change_playback_mode)
-        self.tray_actions['mute'].triggered.connect(self.music_player_window.toggle_mute)
-        self.tray_actions['open'].triggered.connect(self.open_music_player)
-
-        self.music_menu.addAction(self.tray_actions['play_pause'])
-        self.music_menu.addAction(self.tray_actions['prev'])
-        self.music_menu.addAction(self.tray_actions['next'])
-        self.music_menu.addSeparator()
-        self.music_menu.addAction(self.tray_actions['loop'])
-        self.music_menu.addAction(self.tray_actions['mute'])
-        self.music_menu.addSeparator()
-        self.music_menu.addAction(self.tray_actions['open'])
-        
-        tray_menu.addMenu(self.music_menu)
-
-        self.toggle_action = QAction("Hide", self)
-        self.toggle_action.triggered.connect(self.toggle_visibility)
-        tray_menu.addAction(self.toggle_action)
-        tray_menu.addSeparator()
-        exit_action = QAction("Exit", self)
-        exit_action.triggered.connect(QApplication.instance().quit)
-        tray_menu.addAction(exit_action)
-        self.tray_icon.setContextMenu(tray_menu)
-        self.tray_icon.show()
-
-    def open_music_player(self):
-        self.music_player_window.show()
-        self.music_player_window.activateWindow()
-
     def start_intro_sequence(self):
-        self.music_menu.setEnabled(False)
+        self.host.music_menu.setEnabled(False)
         hour = datetime.now().hour
         greeting = "Good morning!" if 5 <= hour < 12 else "Good afternoon!" if 12 <= hour < 18 else "Good evening!"
         self.show_bubble(greeting)
-        self.animation_timer.start(300)
-        QTimer.singleShot(1200, self.ask_question)
+        self.transition('intro')
+        self.scheduler.call_later(1200, self.ask_question)
 
     def start_main_lifecycle(self):
-        self.music_menu.setEnabled(True)
-        if self.bubble:
-            self.bubble.hide()
-        self.display_check_timer.start(2000)
-        self.enter_walking_state()
+        self.host.music_menu.setEnabled(True)
+        self.host.bubble.dismiss(self)
+        self.transition('walking')
     
-    def toggle_visibility(self):
-        if self.isVisible():
-            self.hide()
-            self.toggle_action.setText("Show")
+    ### Power Management ###
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Type.Expose:
+            if watched.isExposed() and tracer.mark("fox_visible"):
+                tracer.write()
+            self.host.update_power_state()
+        return super().eventFilter(watched, event)
+
+    def restart_animation(self):
+        if self.animation_call:
+            self.start_animation(self.STATES[self.state][1])
+
+    def start_animation(self, interval):
+        if self.animation_call:
+            self.animation_call.cancel()
+            self.state_calls.remove(self.animation_call)
+        slowdown = self.BATTERY_SLOWDOWN if self.host.on_battery else 1
+        if interval:
+            self.animation_call = self.scheduler.call_every(interval * slowdown, self.update_animation_frame)
         else:
-            self.show()
-            self.toggle_action.setText("Hide")
+            # Frames with their own delays (decoded from a GIF) chain one call per frame
+            delays = self.frame_delays[self.STATES[self.state][0]]
+            self.animation_call = self.scheduler.call_later(delays[self.frame_index] * slowdown, self.advance_timed_frame)
+        self.state_calls.append(self.animation_call)
+
+    def advance_timed_frame(self):
+        self.update_animation_frame()
+        self.start_animation(None)
 
     def closeEvent(self, event):
-        self.tray_icon.hide()
+        # The tray icon stays as long as any other fox is still around
+        if not any(pet.isVisible() for pet in self.host.pets if pet is not self):
+            self.host.tray_icon.hide()
         event.accept()
 
     def ask_question(self):
         question = choice(self.questions)
         self.show_bubble(question, word_wrap=False)
-        QTimer.singleShot(2000, lambda: self.show_rating_dialog(question))
+        self.scheduler.call_later(2000, partial(self.show_rating_dialog, question))
 
     def show_rating_dialog(self, question_text):
-        if self.bubble:
-            self.bubble.hide()
+        self.host.bubble.dismiss(self)
         dialog = RatingDialog(question_text, self)
         if dialog.exec() == QDialog.DialogCode.Accepted:
             self.show_response(dialog.get_rating())
@@ -705,124 +2774,96 @@ class DesktopPet(QWidget):
     def show_response(self, rating):
         response_text = choice(self.responses[rating])
         self.show_bubble(response_text)
-        QTimer.singleShot(3000, self.start_main_lifecycle)
+        self.scheduler.call_later(3000, self.start_main_lifecycle)
 
     def show_bubble(self, text, word_wrap=True):
-        if self.bubble:
-            self.bubble.deleteLater()
-        self.bubble = SpeechBubble(text, self, word_wrap=word_wrap)
-        self.bubble.show_smartly_positioned()
+        self.host.bubble.show_message(text, self, word_wrap)
+
+    def moveEvent(self, event):
+        # A bubble stays with its fox while it walks or is dragged
+        if self.host.bubble.anchor is self:
+            self.host.bubble.follow()
+
+    ### State Machine ###
+    def transition(self, state):
+        for call in self.state_calls:
+            call.cancel()
+        self.state_calls = []
+        self.animation_call = None
+        self.state = state
+
+        animation, interval, duration, next_state = self.STATES[state]
+        on_enter = getattr(self, f"on_enter_{state}", None)
+        if on_enter:
+            override = on_enter()
+            if override:
+                duration, next_state = override
+
+        if interval:
+            self.start_animation(interval)
+        elif animation in self.frame_delays:
+            self.frame_index = 0
+            self.show_pose(animation)
+            self.start_animation(None)
+        else:
+            self.show_pose(animation)
+        if duration:
+            self.state_calls.append(self.scheduler.call_later(randint(*duration), partial(self.transition, next_state), self.TICK_MS))
 
-    def switch_state(self):
-        if self.state == 'walking':
-            self.state = 'idling_before_sleep'
-            self.walk_logic_timer.stop()
-            self.animation_timer.stop()
-            idle_sprite = self.assets['posture_idle_right'] if self.direction == 1 else self.assets['posture_idle_left']
-            self.pet_label.setPixmap(idle_sprite)
-            QTimer.singleShot(randint(700, 1200), self.enter_sleeping_state)
-        elif self.state == 'sleeping':
-            self.state = 'waking_up'
-            self.assets['sleep'].stop()
-            idle_sprite = self.assets['posture_idle_right'] if self.direction == 1 else self.assets['posture_idle_left']
-            self.pet_label.setPixmap(idle_sprite)
-            QTimer.singleShot(randint(700, 1200), self.enter_walking_state)
-
-    def enter_walking_state(self):
-        self.state = 'walking'
-        self.animation_timer.setInterval(150)
-        if not self.animation_timer.isActive():
-            self.animation_timer.start()
-        self.state_change_timer.start(randint(30, 40) * 1000)
+    def on_enter_walking(self):
         self.walk_direction_duration = 0
-        self.walk_logic_timer.start(1000)
+        self.wonder_count = 0
+        self.state_calls.append(self.scheduler.call_every(1000, self.update_walk_logic))
+        # The walk cycle keeps counting through pauses, turns and wags; only a fresh cycle re-arms it,
+        # and a deadline that expired during one of them is honored by the next walk logic tick
+        if self.sleep_call is None and not self.sleep_due:
+            self.sleep_call = self.scheduler.call_later(randint(30, 40) * 1000, self.sleep_when_ready, self.TICK_MS)
+
+    def on_enter_idling_before_sleep(self):
+        self.sleep_due = False
 
-    def enter_sleeping_state(self):
-        self.state = 'sleeping'
-        self.animation_timer.stop()
-        self.pet_label.setMovie(self.assets['sleep'])
-        self.assets['sleep'].start()
-        self.state_change_timer.start(randint(10, 20) * 1000)
+    def on_enter_turned(self):
+        self.direction = self.turn_new_direction
+
+    def on_enter_wondering(self):
+        if self.wonder_count <= 0:
+            self.wonder_count = randint(1, 3)
+        self.wonder_count -= 1
+        self.direction *= -1
+        if self.wonder_count <= 0:
+            return (500, 800), 'walking'
+
+    def on_enter_post_trauma(self):
+        self.frame_index = 0
+
+    def sleep_when_ready(self):
+        self.sleep_call = None
+        self.sleep_due = True
+        if self.state == 'walking':
+            self.transition('idling_before_sleep')
 
     def update_walk_logic(self):
-        if self.state != 'walking':
+        if self.sleep_due:
+            self.transition('idling_before_sleep')
             return
         self.walk_direction_duration += 1
         r = random()
         if r < 0.04:
-            self.initiate_wagging()
+            self.transition('wagging')
         elif r < 0.09:
-            self.initiate_pause()
+            self.transition('pausing')
         elif r < 0.14:
-            self.initiate_wondering()
+            self.transition('wondering')
         elif r < 0.22:
             self.initiate_turn()
         elif self.walk_direction_duration > 15:
             self.initiate_turn()
 
-    def initiate_pause(self):
-        if self.state != 'walking':
-            return
-        self.state = 'pausing'
-        self.walk_logic_timer.stop()
-        self.animation_timer.stop()
-        idle_sprite = self.assets['posture_idle_right'] if self.direction == 1 else self.assets['posture_idle_left']
-        self.pet_label.setPixmap(idle_sprite)
-        QTimer.singleShot(randint(1500, 3000), self.resume_walking)
-
     def initiate_turn(self, new_direction=None):
         if self.state != 'walking':
             return
-        self.state = 'turning'
-        self.walk_logic_timer.stop()
-        self.animation_timer.stop()
         self.turn_new_direction = new_direction if new_direction is not None else self.direction * -1
-        idle_sprite = self.assets['posture_idle_right'] if self.direction == 1 else self.assets['posture_idle_left']
-        self.pet_label.setPixmap(idle_sprite)
-        QTimer.singleShot(randint(300, 500), self.complete_turn)
-
-    def complete_turn(self):
-        self.direction = self.turn_new_direction
-        idle_sprite = self.assets['posture_idle_right'] if self.direction == 1 else self.assets['posture_idle_left']
-        self.pet_label.setPixmap(idle_sprite)
-        QTimer.singleShot(randint(300, 500), self.resume_walking)
-
-    def initiate_wondering(self):
-        if self.state != 'walking':
-            return
-        self.state = 'wondering'
-        self.walk_logic_timer.stop()
-        self.animation_timer.stop()
-        self.wonder_count = randint(1, 3)
-        self.perform_wonder_step()
-
-    def perform_wonder_step(self):
-        self.wonder_count -= 1
-        self.direction *= -1
-        idle_sprite = self.assets['posture_idle_right'] if self.direction == 1 else self.assets['posture_idle_left']
-        self.pet_label.setPixmap(idle_sprite)
-        if self.wonder_count > 0:
-            QTimer.singleShot(randint(600, 1000), self.perform_wonder_step)
-        else:
-            QTimer.singleShot(randint(500, 800), self.resume_walking)
-
-    def initiate_wagging(self):
-        if self.state != 'walking':
-            return
-        self.state = 'wagging'
-        self.walk_logic_timer.stop()
-        self.animation_timer.setInterval(300)
-        if not self.animation_timer.isActive():
-            self.animation_timer.start()
-        QTimer.singleShot(randint(1500, 3000), self.resume_walking)
-
-    def resume_walking(self):
-        self.state = 'walking'
-        self.animation_timer.setInterval(150)
-        if not self.animation_timer.isActive():
-            self.animation_timer.start()
-        self.walk_direction_duration = 0
-        self.walk_logic_timer.start(1000)
+        self.transition('turning')
 
     def mousePressEvent(self, event):
         if self.state == 'intro':
@@ -830,13 +2871,10 @@ class DesktopPet(QWidget):
         if event.button() == Qt.MouseButton.LeftButton:
             self.is_dragging = True
             self.drag_start_pos = event.globalPosition()
-            self.state_change_timer.stop()
-            self.walk_logic_timer.stop()
-            self.animation_timer.stop()
-            self.assets['sleep'].stop()
-            self.state = 'shock'
-            shock_sprite = self.assets['shock_right'] if self.direction == 1 else self.assets['shock_left']
-            self.pet_label.setPixmap(shock_sprite)
+            if self.sleep_call:
+                self.sleep_call.cancel()
+                self.sleep_call = None
+            self.transition('shock')
 
     def mouseMoveEvent(self, event):
         if self.is_dragging:
@@ -850,62 +2888,231 @@ class DesktopPet(QWidget):
         if event.button() == Qt.MouseButton.LeftButton:
             self.is_dragging = False
             self.drag_start_pos = None
-            self.move(self.x(), self.base_y)
-            self.state = 'post_trauma'
-            self.frame_index = 0
-            self.animation_timer.setInterval(300)
-            if not self.animation_timer.isActive():
-                self.animation_timer.start()
-            self.post_trauma_timer.start(randint(2000, 3000))
-
-    def resume_from_trauma(self):
-        self.state = 'recovering'
-        self.animation_timer.stop()
-        idle_sprite = self.assets['posture_idle_right'] if self.direction == 1 else self.assets['posture_idle_left']
-        self.pet_label.setPixmap(idle_sprite)
-        QTimer.singleShot(randint(500, 1000), self.start_main_lifecycle)
+            x = min(max(self.x(), self.walk_min_x), self.walk_max_x)
+            self.move(x, self.base_y_at(x))
+            self.transition('post_trauma')
+
+    def show_pose(self, animation):
+        self.pet_label.setPixmap(self.frames[animation][self.direction][0])
 
     def update_animation_frame(self):
         if self.is_dragging:
             return
+        animation = self.STATES[self.state][0]
         if self.state == 'walking':
-            if (self.x() >= self.available_geometry.width() - self.width() and self.direction == 1):
+            if (self.x() >= self.walk_max_x and self.direction == 1):
                 self.initiate_turn(new_direction=-1)
                 return
-            elif (self.x() <= 0 and self.direction == -1):
+            elif (self.x() <= self.walk_min_x and self.direction == -1):
                 self.initiate_turn(new_direction=1)
                 return
-            self.move(self.x() + (self.speed * self.direction), self.y())
-            frames = self.assets['walk_right'] if self.direction == 1 else self.assets['walk_left']
-            self.frame_index = (self.frame_index + 1) % len(frames)
-            self.pet_label.setPixmap(frames[self.frame_index])
-        elif self.state == 'post_trauma':
-            frames = self.assets['post_trauma_right'] if self.direction == 1 else self.assets['post_trauma_left']
-            self.frame_index = (self.frame_index + 1) % len(frames)
-            self.pet_label.setPixmap(frames[self.frame_index])
-        elif self.state in ['intro', 'wagging']:
-            frames = self.assets['idle']
-            self.frame_index = (self.frame_index + 1) % len(frames)
-            self.pet_label.setPixmap(frames[self.frame_index])
-
-    def update_position(self):
-        self.available_geometry = QApplication.primaryScreen().availableGeometry()
-        self.base_y = self.available_geometry.height() - self.height() - 10
-        if not (0 <= self.x() <= self.available_geometry.width() - self.width()):
-            x = self.available_geometry.width() - self.width() - 50
-            self.move(x, self.base_y)
+            slowdown = self.BATTERY_SLOWDOWN if self.host.on_battery else 1
+            x = self.x() + (self.speed * slowdown * self.direction)
+            left, right, base_y = self.current_span
+            if not (left <= x <= right):
+                base_y = self.base_y_at(x)
+            self.move(x, base_y)
+        frames = self.frames[animation][self.direction]
+        self.frame_index = (self.frame_index + 1) % len(frames)
+        self.pet_label.setPixmap(frames[self.frame_index])
+
+    ### Display Handling ###
+    def watch_screens(self):
+        app = QApplication.instance()
+        app.screenAdded.connect(self.on_screen_added)
+        app.screenRemoved.connect(self.on_screen_removed)
+        app.primaryScreenChanged.connect(self.update_position)
+        for screen in app.screens():
+            self.on_screen_added(screen)
+
+    def on_screen_added(self, screen):
+        screen.geometryChanged.connect(self.update_position)
+        screen.availableGeometryChanged.connect(self.update_position)
+        self.update_position()
+
+    def on_screen_removed(self, screen):
+        # The removed screen is still listed while this signal is being delivered
+        QTimer.singleShot(0, self.update_position)
+
+    def update_position(self, *_):
+        # The fox walks along the bottom of whichever monitor it is over, across the whole virtual desktop
+        self.screen_spans = sorted((area.left(), area.right() + 1 - self.width(), area.bottom() + 1 - self.height() - 10)
+                                   for area in (screen.availableGeometry() for screen in QApplication.screens()))
+        self.walk_min_x = min(span[0] for span in self.screen_spans)
+        self.walk_max_x = max(span[1] for span in self.screen_spans)
+        x = self.x()
+        if not (self.walk_min_x <= x <= self.walk_max_x):
+            x = QApplication.primaryScreen().availableGeometry().right() + 1 - self.width() - 50
+        self.move(x, self.base_y_at(x))
+
+    def base_y_at(self, x):
+        containing = [span for span in self.screen_spans if span[0] <= x <= span[1]]
+        if containing:
+            self.current_span = min(containing, key=lambda span: abs(span[2] - self.y()))
         else:
-            self.move(self.x(), self.base_y)
+            self.current_span = min(self.screen_spans, key=lambda span: min(abs(span[0] - x), abs(span[1] - x)))
+        return self.current_span[2]
+
+### --- Pet Host --- ###
+class PetHost(QObject):
+    # Everything the foxes have in common: sprite frames, one scheduler ticking all of them in the same wakeups,
+    # power state, the tray icon and the music player. Each extra fox only adds its own window and state machine
+    MAX_PETS = 32
 
-    def check_display_changes(self):
-        current_screen = QApplication.primaryScreen().geometry()
-        current_available = QApplication.primaryScreen().availableGeometry()
-        if (current_screen != self.screen_geometry or current_available != self.available_geometry):
-            self.screen_geometry = current_screen
-            self.available_geometry = current_available
-            self.update_position()
+    def __init__(self, count=None, parent=None):
+        super().__init__(parent)
+        with tracer.phase("sprite atlas"):
+            atlas = SpriteAtlas()
+            self.frames = atlas.load()
+            self.frame_delays = atlas.delays
+        self.scheduler = BehaviorScheduler(self)
+        self.on_battery = on_battery_power()
+        self.scheduler.call_every(60000, self.check_power_source)
+        # A single speech bubble window serves every fox
+        self.bubble = SpeechBubble()
+        self.pets = []
+
+        ### Music Player Initialization ###
+        with tracer.phase("music player"):
+            self._initialize_music_player()
+        with tracer.phase("tray icon"):
+            self.setup_tray_icon()
+        tracer.mark("tray_ready")
+
+        ### Pets ###
+        count = self.clamp_pet_count(self.session.state.get("pet_count", 1) if count is None else count)
+        self.pets = [DesktopPet(self, index) for index in range(count)]
+        # Only the first fox greets and asks how you are; the others go straight to their walk
+        self.pets[0].start_intro_sequence()
+        for pet in self.pets[1:]:
+            pet.transition('walking')
+        with tracer.phase("show"):
+            for pet in self.pets:
+                pet.show()
+                pet.windowHandle().installEventFilter(pet)
+
+        app = QApplication.instance()
+        app.aboutToQuit.connect(self.save_config)
+
+    def _initialize_music_player(self):
+        self.tray_actions = {
+            'play_pause': QAction("Play"),
+            'prev': QAction("Previous"),
+            'next': QAction("Next"),
+            'loop': QAction("Mode: Loop All"),
+            'mute': QAction("Mute"),
+            'rescan': QAction("Rescan Library"),
+            'open': QAction("Open Player")
+        }
+        self.session = SessionStore(parent=self)
+        self.media_player = PlaybackEngine(crossfade_ms=self.session.state.get("crossfade_ms", 0), parent=self)
+        self.music_player = MusicPlayerController(self.media_player, self.tray_actions, self.session, parent=self)
+        # The player window and its widgets are only built the first time "Open Player" is used
+        self.music_player_window = None
+
+    def save_config(self):
+        if not self.music_player or not self.media_player:
+            return
+
+        self.music_player.save_shuffle()
+        self.session.update(
+            last_track_path=self.music_player.current_path(),
+            last_position=self.media_player.position(),
+            was_playing=self.media_player.playbackState() == QMediaPlayer.PlaybackState.PlayingState,
+            volume=round(self.music_player.volume * 100),
+            is_muted=self.media_player.isMuted(),
+            playback_mode=self.music_player.playback_mode
+        )
+        self.session.flush()
+
+    def setup_tray_icon(self):
+        self.tray_icon = QSystemTrayIcon(self)
+        self.tray_icon.setIcon(QIcon(os.path.join('images', 'logo.png')))
+        self.tray_icon.setToolTip("Your Pet")
+        
+        tray_menu = QMenu()
+        
+        self.music_menu = QMenu("Music")
+        
+        self.tray_actions['play_pause'].triggered.connect(self.music_player.toggle_play_pause)
+        self.tray_actions['prev'].triggered.connect(self.music_player.prev_song)
+        self.tray_actions['next'].triggered.connect(self.music_player.next_song)
+        self.tray_actions['loop'].triggered.connect(self.music_player.change_playback_mode)
+        self.tray_actions['mute'].triggered.connect(self.music_player.toggle_mute)
+        self.tray_actions['rescan'].triggered.connect(self.music_player.rescan_library)
+        self.tray_actions['open'].triggered.connect(self.open_music_player)
+
+        self.music_menu.addAction(self.tray_actions['play_pause'])
+        self.music_menu.addAction(self.tray_actions['prev'])
+        self.music_menu.addAction(self.tray_actions['next'])
+        self.music_menu.addSeparator()
+        self.music_menu.addAction(self.tray_actions['loop'])
+        self.music_menu.addAction(self.tray_actions['mute'])
+        self.music_menu.addSeparator()
+        self.music_menu.addAction(self.tray_actions['rescan'])
+        self.music_menu.addAction(self.tray_actions['open'])
+        
+        tray_menu.addMenu(self.music_menu)
+
+        self.toggle_action = QAction("Hide", self)
+        self.toggle_action.triggered.connect(self.toggle_visibility)
+        tray_menu.addAction(self.toggle_action)
+        tray_menu.addSeparator()
+        exit_action = QAction("Exit", self)
+        exit_action.triggered.connect(QApplication.instance().quit)
+        tray_menu.addAction(exit_action)
+        self.tray_icon.setContextMenu(tray_menu)
+        self.tray_icon.show()
+
+    def open_music_player(self):
+        if self.music_player_window is None:
+            with tracer.phase("MusicPlayerWindow"):
+                self.music_player_window = MusicPlayerWindow(self.music_player)
+        self.music_player_window.show()
+        self.music_player_window.activateWindow()
+
+    def toggle_visibility(self):
+        visible = not any(pet.isVisible() for pet in self.pets)
+        for pet in self.pets:
+            pet.setVisible(visible)
+        self.toggle_action.setText("Hide" if visible else "Show")
+        self.update_power_state()
+
+    def update_power_state(self):
+        # Nothing ticks while every fox is hidden or fully covered; they pick up in the same state afterwards
+        active = any(pet.isVisible() and pet.windowHandle() is not None and pet.windowHandle().isExposed() for pet in self.pets)
+        if active != self.scheduler.is_suspended:
+            return
+        if active:
+            self.scheduler.resume()
+        else:
+            self.scheduler.suspend()
+
+    @classmethod
+    def clamp_pet_count(cls, value):
+        # "pet_count" is edited by hand in config.json; anything that is not a usable number means one fox
+        try:
+            count = int(value)
+        except (TypeError, ValueError, OverflowError):
+            return 1
+        return min(max(1, count), cls.MAX_PETS)
+
+    def check_power_source(self):
+        tracer.counter("wakeups_per_minute", self.scheduler.wakeups_per_minute())
+        on_battery = on_battery_power()
+        if on_battery != self.on_battery:
+            self.on_battery = on_battery
+            for pet in self.pets:
+                pet.restart_animation()
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    pet = DesktopPet()
-    sys.exit(app.exec())
+    with tracer.phase("QApplication"):
+        app = QApplication(sys.argv)
+    # --pets=<n> overrides "pet_count" in config.json
+    pet_count = next((int(arg[7:]) for arg in sys.argv[1:] if arg.startswith("--pets=") and arg[7:].isdigit()), None)
+    with tracer.phase("PetHost"):
+        host = PetHost(pet_count)
+    exit_code = app.exec()
+    tracer.counter("wakeups_per_minute", host.scheduler.wakeups_per_minute())
+    tracer.write()
+    sys.exit(exit_code)
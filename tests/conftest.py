@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# main.py lives at the repository root, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+@pytest.fixture(scope="session")
+def app():
+    # One application object for the whole run; pixmaps need a GUI application, models and signals any
+    from PySide6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
@@ -0,0 +1,129 @@
+import os
+import shutil
+import struct
+import time
+
+import pytest
+
+from main import LibraryScanner
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(app, tmp_path, monkeypatch):
+    # The scanner keeps embedded covers in ./cover-cache and prunes it after a full scan
+    monkeypatch.chdir(tmp_path)
+
+def add_track(folder, name):
+    path = folder / name
+    path.write_bytes(b'\0' * 64)
+    # Older than the settle time, so the scanner treats the file as completely copied
+    old = time.time() - 60
+    os.utime(path, (old, old))
+    return str(path)
+
+def scan(music_dir, db_path, folders=None):
+    scanner = LibraryScanner(music_dir=str(music_dir), db_path=db_path, folders=folders)
+    found, changes = [], []
+    scanner.signals.songs_found.connect(found.extend)
+    scanner.signals.library_changed.connect(lambda removed, added: changes.append((removed, added)))
+    scanner.run()
+    return found, changes
+
+@pytest.mark.parametrize("db_name", ["library.db", os.path.join("missing", "library.db")])
+def test_update_reports_only_the_difference(tmp_path, db_name):
+    # A db_path in a folder that does not exist forces the in-memory fallback
+    music = tmp_path / "music"
+    album = music / "album"
+    album.mkdir(parents=True)
+    paths = [add_track(album, f"song{i}.mp3") for i in range(5)]
+    found, _ = scan(music, str(tmp_path / db_name))
+    assert sorted(song.path for song in found) == paths
+
+    os.remove(paths[0])
+    new_path = add_track(album, "song5.mp3")
+    _, changes = scan(music, str(tmp_path / db_name), folders={str(album)})
+    assert len(changes) == 1
+    removed, added = changes[0]
+    assert removed == [paths[0]]
+    assert [song.path for song in added] == [new_path]
+
+def test_tracks_still_being_copied_wait_for_a_later_scan(tmp_path):
+    music = tmp_path / "music"
+    music.mkdir()
+    settled = add_track(music, "done.mp3")
+    (music / "copying.mp3").write_bytes(b'\0' * 64)
+    scanner = LibraryScanner(music_dir=str(music), db_path=str(tmp_path / "library.db"))
+    found = []
+    scanner.signals.songs_found.connect(found.extend)
+    scanner.run()
+    assert [song.path for song in found] == [settled]
+    assert scanner.unsettled_folders == {str(music)}
+
+def test_warm_scan_lists_only_changed_folders(tmp_path, monkeypatch):
+    music = tmp_path / "music"
+    nested = music / "artist" / "album"
+    nested.mkdir(parents=True)
+    (music / "other").mkdir()
+    paths = [add_track(nested, "one.mp3"), add_track(music / "other", "two.mp3")]
+    db_path = str(tmp_path / "library.db")
+    scan(music, db_path)
+
+    listed = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        if str(path).startswith(str(music)):
+            listed.append(str(path))
+        return scandir(path)
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    found, _ = scan(music, db_path)
+    assert sorted(song.path for song in found) == sorted(paths)
+    assert listed == []
+
+    paths.append(add_track(nested, "three.mp3"))
+    found, _ = scan(music, db_path)
+    assert sorted(song.path for song in found) == sorted(paths)
+    assert listed == [str(nested)]
+
+def tagged_track(folder, name, title, cover=None):
+    frames = b'TIT2' + struct.pack('>I', len(title) + 1) + b'\0\0\0' + title.encode()
+    if cover:
+        body = b'\0image/jpeg\0\x03\0' + cover
+        frames += b'APIC' + struct.pack('>I', len(body)) + b'\0\0' + body
+    size = len(frames)
+    path = folder / name
+    path.write_bytes(b'ID3\3\0\0' + bytes([size >> 21 & 0x7F, size >> 14 & 0x7F, size >> 7 & 0x7F, size & 0x7F]) + frames)
+    old = time.time() - 60
+    os.utime(path, (old, old))
+    return str(path)
+
+def test_tags_edited_in_place_are_read_again(tmp_path):
+    music = tmp_path / "music"
+    music.mkdir()
+    tagged_track(music, "track.mp3", "Before")
+    found, _ = scan(music, "library.db")
+    assert [song.title for song in found] == ["Before"]
+
+    # Rewriting the file in place leaves the folder mtime as it was
+    folder_mtime = os.stat(music).st_mtime_ns
+    tagged_track(music, "track.mp3", "After, longer")
+    os.utime(music, ns=(folder_mtime, folder_mtime))
+    found, _ = scan(music, "library.db")
+    assert [song.title for song in found] == ["After, longer"]
+
+def test_unused_covers_are_deleted_after_a_scan(tmp_path):
+    music = tmp_path / "music"
+    (music / "a").mkdir(parents=True)
+    (music / "b").mkdir()
+    tagged_track(music / "a", "one.mp3", "One", b'first cover')
+    tagged_track(music / "b", "two.mp3", "Two", b'second cover')
+    found, _ = scan(music, "library.db")
+    assert len(os.listdir("cover-cache")) == 2
+
+    tagged_track(music / "a", "one.mp3", "One", b'replaced cover')
+    shutil.rmtree(music / "b")
+    found, _ = scan(music, "library.db")
+    covers = os.listdir("cover-cache")
+    assert len(covers) == 1
+    assert found[0].thumbnail == os.path.join("cover-cache", covers[0])
+    with open(found[0].thumbnail, 'rb') as f:
+        assert f.read() == b'replaced cover'
@@ -0,0 +1,10 @@
+import pytest
+
+from main import PetHost
+
+@pytest.mark.parametrize("value, expected", [
+    (3, 3), ("2", 2), (None, 1), ("many", 1), ([2], 1), (0, 1), (-4, 1), (2.7, 2),
+    (float('inf'), 1), (10 ** 6, PetHost.MAX_PETS),
+])
+def test_clamp_pet_count(value, expected):
+    assert PetHost.clamp_pet_count(value) == expected
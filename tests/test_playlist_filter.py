@@ -0,0 +1,58 @@
+from PySide6.QtCore import QEventLoop, QTimer
+
+from main import PlaylistFilterModel, PlaylistModel, Song, SongTable
+
+ARTISTS = ["Alpha", "Bravo", "Charlie", "Delta", "Echo"]
+
+def make_model(count):
+    model = PlaylistModel(SongTable())
+    model.append_songs([Song(f"Song {i}", ARTISTS[i % 5], f"/music/{i}.mp3", None) for i in range(count)])
+    return model
+
+def wait_until_indexed(app, proxy):
+    loop = QEventLoop()
+    proxy.indexing_finished.connect(loop.quit)
+    QTimer.singleShot(5000, loop.quit)
+    loop.exec()
+
+def visible_titles(proxy):
+    table = proxy.sourceModel().table
+    return [table.titles[proxy.mapToSource(proxy.index(row)).row()] for row in range(proxy.rowCount())]
+
+def test_existing_rows_are_indexed_in_chunks(app):
+    model = make_model(2500)
+    proxy = PlaylistFilterModel(model)
+    assert proxy.rowCount() == 0
+    wait_until_indexed(app, proxy)
+    assert proxy.rowCount() == 2500
+    proxy.set_query("song 2499")
+    assert visible_titles(proxy) == ["Song 2499"]
+
+def test_query_and_changes_during_indexing(app):
+    model = make_model(2500)
+    proxy = PlaylistFilterModel(model)
+    proxy.index_next_chunk()
+    proxy.set_query("bravo")
+    assert proxy.rowCount() == PlaylistFilterModel.INDEX_CHUNK // 5
+    # Removed rows straddle the indexed part and the backlog
+    model.remove_rows(range(990, 1010))
+    model.append_songs([Song("Late", "Bravo", "/music/late.mp3", None)])
+    wait_until_indexed(app, proxy)
+    expected = [f"Song {i}" for i in range(2500) if i % 5 == 1 and not 990 <= i < 1010] + ["Late"]
+    assert visible_titles(proxy) == expected
+    proxy.set_query("")
+    assert proxy.rowCount() == len(model.table) == 2481
+
+def test_typing_narrows_to_the_same_rows_as_a_fresh_query(app):
+    model = make_model(300)
+    proxy = PlaylistFilterModel(model)
+    wait_until_indexed(app, proxy)
+    query = "song 1 bravo"
+    for length in range(1, len(query) + 1):
+        proxy.set_query(query[:length])
+        typed = visible_titles(proxy)
+        fresh = PlaylistFilterModel(model)
+        wait_until_indexed(app, fresh)
+        fresh.set_query(query[:length])
+        assert typed == visible_titles(fresh)
+    assert typed == [f"Song {i}" for i in range(300) if i % 5 == 1 and "1" in str(i)]
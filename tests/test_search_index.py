@@ -0,0 +1,58 @@
+from main import SearchIndex
+
+def build(*entries):
+    index = SearchIndex()
+    index.extend([title for title, _ in entries], [artist for _, artist in entries])
+    return index
+
+def test_normalize_folds_case_and_accents():
+    assert SearchIndex.normalize("Björk Ødegård") == "bjork odegard"
+    assert SearchIndex.normalize("ŁÓDŹ") == "lodz"
+
+def test_search_keeps_playlist_order():
+    index = build(("Yellow", "Coldplay"), ("Clocks", "Coldplay"), ("Hello", "Adele"))
+    assert index.search(["coldplay"]) == [0, 1]
+    assert index.search(["ell"]) == [0, 2]
+    assert index.search(["clocks", "coldplay"]) == [1]
+    assert index.search(["missing"]) == []
+
+def test_short_words_are_checked_without_trigrams():
+    index = build(("A1", "x"), ("B2", "y"), ("A2", "z"))
+    assert index.search(["a"]) == [0, 2]
+    assert index.search(["2"]) == [1, 2]
+
+def test_trigram_hits_still_need_the_whole_word():
+    # "abcxbcd" holds every trigram of "abcd" but not the word itself
+    index = build(("abcxbcd", ""), ("abcd", ""))
+    assert index.search(["abcd"]) == [1]
+
+def test_search_within_narrows_a_previous_result():
+    index = build(("Song 1", "Artist"), ("Song 2", "Artist"), ("Song 12", "Other"))
+    previous = index.search(["song", "1"])
+    assert previous == [0, 2]
+    assert index.search(["song", "12"], previous) == [2]
+
+def test_remove_renumbers_rows():
+    index = build(("one", ""), ("two", ""), ("three", ""), ("twenty", ""))
+    index.remove(0, 1)
+    assert index.search(["thr"]) == [0]
+    assert index.search(["twe"]) == [1]
+    assert index.search(["two"]) == []
+    index.extend(["twofold"], [""])
+    assert index.search(["two"]) == [2]
+
+def test_clear():
+    index = build(("one", ""))
+    index.clear()
+    assert index.search(["one"]) == []
+
+def test_broad_and_rare_queries_agree_with_a_plain_scan():
+    titles = [f"Song {i}" for i in range(400)]
+    artists = [f"Artist {i % 7}" for i in range(400)]
+    index = SearchIndex()
+    index.extend(titles, artists)
+    index.remove(10, 19)
+    keys = [SearchIndex.normalize(f"{title} {artist}") for title, artist in zip(titles, artists)]
+    del keys[10:20]
+    for words in (["artist", "5"], ["song"], ["song", "12"], ["399"], ["artist", "3", "song", "1"]):
+        assert index.search(words) == [row for row, key in enumerate(keys) if all(word in key for word in words)]
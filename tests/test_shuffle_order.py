@@ -0,0 +1,88 @@
+from main import ShuffleOrder
+
+def play_cycle(shuffle_order, table, current=None):
+    played = []
+    for _ in range(len(table)):
+        current = shuffle_order.advance(current, table)
+        played.append(current)
+    return played
+
+def test_every_track_plays_once_per_cycle():
+    table = set(range(10))
+    order = ShuffleOrder()
+    order.add(table)
+    first = play_cycle(order, table)
+    assert sorted(first) == sorted(table)
+    second = play_cycle(order, table, first[-1])
+    assert sorted(second) == sorted(table)
+    # A new cycle never starts with the track that just ended the previous one
+    assert second[0] != first[-1]
+
+def test_back_and_forward_retrace_history():
+    table = set(range(5))
+    order = ShuffleOrder()
+    order.add(table)
+    played = [order.advance(None, table)]
+    for _ in range(3):
+        played.append(order.advance(played[-1], table))
+    assert order.back(played[3], table) == played[2]
+    assert order.back(played[2], table) == played[1]
+    # Going forward again replays what was stepped back over before continuing the cycle
+    assert order.advance(played[1], table) == played[2]
+    assert order.advance(played[2], table) == played[3]
+    remaining = order.advance(played[3], table)
+    assert remaining not in played
+
+def test_jump_clears_forward_history():
+    table = set(range(5))
+    order = ShuffleOrder()
+    order.add(table)
+    first = order.advance(None, table)
+    second = order.advance(first, table)
+    order.back(second, table)
+    assert order.forward == [second]
+    order.jump(first)
+    assert order.forward == []
+    assert order.history[-1] == first
+
+def test_tracks_missing_from_the_table_are_skipped():
+    table = set(range(6))
+    order = ShuffleOrder()
+    order.add(table)
+    upcoming = order.peek(table)
+    table.discard(upcoming)
+    played = [order.advance(None, table) for _ in range(5)]
+    assert upcoming not in played
+    assert sorted(played) == sorted(table)
+
+def test_added_tracks_join_the_current_cycle():
+    table = set(range(4))
+    order = ShuffleOrder()
+    order.add(table)
+    current = order.advance(None, table)
+    table.update({10, 11})
+    order.add([10, 11])
+    played = [current] + [order.advance(None, table) for _ in range(5)]
+    assert sorted(played) == sorted(table)
+
+def test_state_round_trip():
+    table = set(range(8))
+    order = ShuffleOrder()
+    order.add(table)
+    current = None
+    for _ in range(3):
+        current = order.advance(current, table)
+    restored = ShuffleOrder()
+    restored.restore(order.state(), list(order.order))
+    assert restored.peek(table) == order.peek(table)
+    assert list(restored.history) == list(order.history)
+
+def test_order_changed_is_set_only_when_the_permutation_changes():
+    table = set(range(4))
+    order = ShuffleOrder()
+    order.add(table)
+    current = order.advance(None, table)
+    assert order.order_changed
+    order.order_changed = False
+    order.advance(current, table)
+    assert not order.order_changed
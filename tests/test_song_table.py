@@ -0,0 +1,44 @@
+from main import Song, SongTable, track_id
+
+def make_songs(*names):
+    return [Song(name, f"{name} artist", f"/music/{name}.mp3", None, "Album", 1000) for name in names]
+
+def test_extend_maps_ids_to_rows():
+    table = SongTable()
+    table.extend(make_songs("a", "b", "c"))
+    assert len(table) == 3
+    assert table[1] == Song("b", "b artist", "/music/b.mp3", None, "Album", 1000)
+    assert table.ids == [track_id(f"/music/{name}.mp3") for name in "abc"]
+    assert table.row_of(track_id("/music/c.mp3")) == 2
+    assert track_id("/music/c.mp3") in table
+
+def test_delete_renumbers_rows_behind_the_gap():
+    table = SongTable()
+    table.extend(make_songs("a", "b", "c", "d", "e"))
+    table.delete(1, 2)
+    assert [song.title for song in (table[row] for row in range(len(table)))] == ["a", "d", "e"]
+    assert track_id("/music/b.mp3") not in table
+    assert table.row_of(track_id("/music/b.mp3")) == -1
+    assert table.row_of(track_id("/music/a.mp3")) == 0
+    assert table.row_of(track_id("/music/d.mp3")) == 1
+    assert table.row_of(track_id("/music/e.mp3")) == 2
+
+def test_several_deletes_before_a_lookup():
+    table = SongTable()
+    table.extend(make_songs("a", "b", "c", "d", "e", "f"))
+    table.delete(4, 4)
+    table.delete(0, 1)
+    assert table.row_of(track_id("/music/f.mp3")) == 2
+    assert table.row_of(track_id("/music/c.mp3")) == 0
+    table.extend(make_songs("g"))
+    assert table.row_of(track_id("/music/g.mp3")) == 3
+
+def test_clear():
+    table = SongTable()
+    table.extend(make_songs("a", "b"))
+    table.delete(0, 0)
+    table.clear()
+    assert len(table) == 0
+    assert track_id("/music/b.mp3") not in table
+    table.extend(make_songs("c"))
+    assert table.row_of(track_id("/music/c.mp3")) == 0
@@ -0,0 +1,35 @@
+import pytest
+from PySide6.QtGui import QColor, QImage
+
+from main import SpriteAtlas
+
+COLORS = {'red.png': 'red', 'green.png': 'green', 'blue.png': 'blue'}
+
+@pytest.fixture
+def frames_dir(app, tmp_path):
+    for name, color in COLORS.items():
+        image = QImage(4, 4, QImage.Format.Format_ARGB32)
+        image.fill(QColor(color))
+        image.save(str(tmp_path / name))
+    return tmp_path
+
+def colors(frames):
+    return [QColor(frame.toImage().pixel(0, 0)).name() for frame in frames]
+
+def test_atlas_is_reused_while_nothing_changes(frames_dir):
+    animations = {'walk': {-1: ['red.png', 'green.png'], 1: ['blue.png']}}
+    SpriteAtlas(str(frames_dir), animations).load()
+    manifest = frames_dir / 'fox-atlas.json'
+    built = manifest.stat().st_mtime_ns
+    frames = SpriteAtlas(str(frames_dir), animations).load()
+    assert manifest.stat().st_mtime_ns == built
+    assert colors(frames['walk'][-1]) == ['#ff0000', '#008000']
+    assert colors(frames['walk'][1]) == ['#0000ff']
+
+def test_changed_animation_table_rebuilds_the_atlas(frames_dir):
+    SpriteAtlas(str(frames_dir), {'walk': {-1: ['red.png', 'green.png'], 1: ['blue.png']}}).load()
+    # Same source files, different order and an extra animation
+    frames = SpriteAtlas(str(frames_dir), {'walk': {-1: ['green.png', 'red.png'], 1: ['blue.png']},
+                                           'idle': {-1: ['blue.png'], 1: ['red.png']}}).load()
+    assert colors(frames['walk'][-1]) == ['#008000', '#ff0000']
+    assert colors(frames['idle'][1]) == ['#ff0000']
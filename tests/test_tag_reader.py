@@ -0,0 +1,98 @@
+import struct
+
+from main import TagReader
+
+def frame(frame_id, body):
+    return frame_id.encode() + struct.pack('>I', len(body)) + b'\0\0' + body
+
+def text_frame(frame_id, text, encoding=3):
+    return frame(frame_id, bytes([encoding]) + text.encode('utf-8' if encoding == 3 else 'latin-1'))
+
+def id3v2(frames, version=3, flags=0):
+    size = len(frames)
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b'ID3' + bytes([version, 0, flags]) + syncsafe + frames
+
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz; 16000 bytes of audio last one second
+MPEG_FRAME = b'\xff\xfb\x90\x00' + b'\0' * 413
+
+def write(tmp_path, data, name="track.mp3"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_reads_text_frames_and_cbr_duration(tmp_path):
+    tag = id3v2(text_frame('TIT2', "Título") + text_frame('TPE1', "Artist") + text_frame('TALB', "Album", 0))
+    path = write(tmp_path, tag + MPEG_FRAME + b'\0' * (16000 - len(MPEG_FRAME)))
+    tags = TagReader(str(tmp_path / "covers")).read(path)
+    assert (tags.title, tags.artist, tags.album, tags.duration, tags.cover) == ("Título", "Artist", "Album", 1000, None)
+
+def test_tlen_overrides_the_estimate(tmp_path):
+    path = write(tmp_path, id3v2(text_frame('TLEN', "215000")) + MPEG_FRAME)
+    assert TagReader().read(path).duration == 215000
+
+def test_id3v22_frames(tmp_path):
+    frames = b'TT2' + (6).to_bytes(3, 'big') + b'\0Title' + b'TP1' + (7).to_bytes(3, 'big') + b'\0Singer'
+    path = write(tmp_path, id3v2(frames, version=2))
+    tags = TagReader().read(path)
+    assert (tags.title, tags.artist) == ("Title", "Singer")
+
+def test_truncated_frame_keeps_earlier_fields(tmp_path):
+    # The last frame claims far more bytes than the tag holds
+    frames = text_frame('TIT2', "Kept") + b'TPE1' + struct.pack('>I', 5000) + b'\0\0\x03Cut'
+    path = write(tmp_path, id3v2(frames))
+    tags = TagReader().read(path)
+    assert tags.title == "Kept"
+    assert tags.artist == "Cut"
+
+def test_garbage_frame_id_stops_parsing(tmp_path):
+    frames = text_frame('TIT2', "First") + b'\x01\x02\x03\x04' + b'\0' * 6 + text_frame('TPE1', "Never")
+    path = write(tmp_path, id3v2(frames))
+    tags = TagReader().read(path)
+    assert (tags.title, tags.artist) == ("First", "")
+
+def test_unknown_text_encoding_is_ignored(tmp_path):
+    path = write(tmp_path, id3v2(frame('TIT2', b'\x09Odd') + text_frame('TPE1', "Artist")))
+    tags = TagReader().read(path)
+    assert (tags.title, tags.artist) == ("", "Artist")
+
+def test_utf16_and_multiple_values(tmp_path):
+    body = b'\x01' + "Über\0Second".encode('utf-16')
+    path = write(tmp_path, id3v2(frame('TIT2', body)))
+    assert TagReader().read(path).title == "Über"
+
+def test_id3v1_fills_missing_fields(tmp_path):
+    v1 = b'TAG' + b'Old Title'.ljust(30, b'\0') + b'Old Artist'.ljust(30, b'\0') + b'Old Album'.ljust(30, b'\0') + b'\0' * 35
+    path = write(tmp_path, id3v2(text_frame('TIT2', "New Title")) + b'\0' * 200 + v1)
+    tags = TagReader().read(path)
+    assert (tags.title, tags.artist, tags.album) == ("New Title", "Old Artist", "Old Album")
+
+def test_file_without_tags(tmp_path):
+    tags = TagReader().read(write(tmp_path, b'\0' * 64))
+    assert tags == ("", "", "", 0, None)
+
+def test_front_cover_is_preferred_and_stored_once(tmp_path):
+    back = frame('APIC', b'\0image/png\0\x04\0' + b'back')
+    front = frame('APIC', b'\0image/jpeg\0\x03desc\0' + b'front')
+    cover_dir = tmp_path / "covers"
+    reader = TagReader(str(cover_dir))
+    first = reader.read(write(tmp_path, id3v2(back + front), "one.mp3"))
+    second = reader.read(write(tmp_path, id3v2(front), "two.mp3"))
+    assert first.cover == second.cover
+    assert first.cover.endswith(".jpg")
+    with open(first.cover, 'rb') as f:
+        assert f.read() == b'front'
+    assert len(list(cover_dir.iterdir())) == 1
+
+def test_picture_without_mime_terminator_is_skipped(tmp_path):
+    path = write(tmp_path, id3v2(frame('APIC', b'\0image/jpeg') + text_frame('TIT2', "Title")))
+    tags = TagReader(str(tmp_path / "covers")).read(path)
+    assert (tags.title, tags.cover) == ("Title", None)
+
+def test_unwritable_cover_cache_keeps_the_text_tags(tmp_path):
+    blocker = tmp_path / "covers"
+    blocker.write_bytes(b'')
+    picture = frame('APIC', b'\0image/jpeg\0\x03\0' + b'art')
+    path = write(tmp_path, id3v2(text_frame('TIT2', "Title") + picture))
+    tags = TagReader(str(blocker)).read(path)
+    assert (tags.title, tags.cover) == ("Title", None)
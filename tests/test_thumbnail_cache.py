@@ -0,0 +1,52 @@
+import os
+
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QColor, QImage
+
+from main import ThumbnailDiskCache, ThumbnailJob, ThumbnailSignals
+
+def cover(tmp_path, name="cover.png", size=64):
+    image = QImage(size, size, QImage.Format.Format_ARGB32)
+    image.fill(QColor('orange'))
+    path = str(tmp_path / name)
+    image.save(path)
+    return path
+
+def run_job(path, disk_cache):
+    signals = ThumbnailSignals()
+    loaded = []
+    signals.loaded.connect(lambda source, image: loaded.append((source, image)))
+    ThumbnailJob(path, QSize(16, 16), disk_cache, signals).run()
+    return loaded
+
+def test_job_stores_and_reuses_a_scaled_copy(app, tmp_path):
+    path = cover(tmp_path)
+    disk_cache = ThumbnailDiskCache(str(tmp_path / "cache"))
+    first = run_job(path, disk_cache)
+    assert first[0][1].size() == QSize(16, 16)
+    assert len(os.listdir(disk_cache.directory)) == 1
+    second = run_job(path, disk_cache)
+    assert second[0][1].size() == QSize(16, 16)
+
+def test_unwritable_cache_still_delivers_the_thumbnail(app, tmp_path):
+    path = cover(tmp_path)
+    # A file where the cache folder should be makes every write fail
+    blocker = tmp_path / "cache"
+    blocker.write_bytes(b'')
+    loaded = run_job(path, ThumbnailDiskCache(str(blocker)))
+    assert len(loaded) == 1
+    assert loaded[0][0] == path
+    assert not loaded[0][1].isNull()
+
+def test_prune_keeps_the_most_recent_entries_within_budget(app, tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    for age, name in enumerate(["new", "middle", "old"]):
+        entry = directory / f"{name}.png"
+        entry.write_bytes(b'\0' * 100)
+        os.utime(entry, (1000 - age, 1000 - age))
+    ThumbnailDiskCache(str(directory), max_bytes=250).prune()
+    assert sorted(os.listdir(directory)) == ["middle.png", "new.png"]
+
+def test_prune_without_a_cache_folder(app, tmp_path):
+    ThumbnailDiskCache(str(tmp_path / "missing")).prune()